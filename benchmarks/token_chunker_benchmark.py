@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import random
+import sys
+import time
+from typing import Callable, Final
+
+# Make the project root importable when run from any directory.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from util import TokenChunker  # noqa: E402
+
+MAX_TOKENS: Final[int] = 8191
+REPEATS: Final[int] = 3
+SIZES_IN_MB: Final[list[int]] = [1, 4, 16]
+WORDS: Final[list[str]] = ["validate", "the", "response", "status", "code", "for", "GET", "/api/v1/quotes", "when",
+                           "the", "user", "is", "not", "authorized", "returns", "400", "expect", "await", "apiGet"]
+
+
+def create_text(size_in_bytes: int) -> str:
+    """
+    Returns random ticket-like text with lines and paragraphs.
+    :param size_in_bytes: The approximate size of the text in bytes.
+    :return: The text.
+    """
+    generator = random.Random(42)
+    lines = []
+    size = 0
+
+    while size < size_in_bytes:
+        line = " ".join(generator.choices(WORDS, k=generator.randint(5, 20)))
+        line += "\n\n" if generator.random() < 0.2 else "\n"
+        lines.append(line)
+        size += len(line)
+
+    return "".join(lines)
+
+
+def legacy_chunk(text: str) -> list[list[int]]:
+    """
+    Splits the text the way the embeddings did before the token chunker: encode the text, decode each slice back to a
+    string, then encode each chunk again when it is embedded.
+    :param text: The text.
+    :return: The token chunks.
+    """
+    tokens = TokenChunker.encode(text)
+    chunks = [TokenChunker.decode(tokens[start:start + MAX_TOKENS]) for start in range(0, len(tokens), MAX_TOKENS)]
+
+    return [TokenChunker.encode(chunk) for chunk in chunks]
+
+
+def measure(function: Callable[[], object]) -> float:
+    """
+    Returns the best time of several runs of the function.
+    :param function: The function.
+    :return: The best time in seconds.
+    """
+    best = float("inf")
+
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def main() -> None:
+    """
+    Benchmarks the token chunker against the legacy chunking, and batch against sequential tokenization.
+    :return: None
+    """
+    print(f"{'size':>8} {'legacy':>10} {'chunker':>10} {'overlap':>10} {'speedup':>8}")
+
+    for size_in_mb in SIZES_IN_MB:
+        text = create_text(size_in_mb * 1024 * 1024)
+        legacy = measure(lambda: legacy_chunk(text))
+        chunker = measure(lambda: TokenChunker.chunk_text(text, max_tokens=MAX_TOKENS))
+        overlap = measure(lambda: TokenChunker.chunk_text(text, max_tokens=MAX_TOKENS, overlap=256))
+        print(f"{size_in_mb:>6}MB {legacy:>9.3f}s {chunker:>9.3f}s {overlap:>9.3f}s {legacy / chunker:>7.2f}x")
+
+    texts = [create_text(256 * 1024) for _ in range(64)]
+    sequential = measure(lambda: [TokenChunker.chunk_text(text, max_tokens=MAX_TOKENS) for text in texts])
+    batch = measure(lambda: TokenChunker.chunk_texts(texts, max_tokens=MAX_TOKENS))
+    print(f"\n64 x 256KB documents: sequential {sequential:.3f}s, batch {batch:.3f}s, "
+          f"speedup {sequential / batch:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,9 @@ _CURRENT_DIR: Final[str] = os.path.dirname(__file__)
 METADATA_DIR: Final[str] = os.path.join(_CURRENT_DIR, "metadata")
 OUTPUT_DIR: Final[str] = os.path.join(_CURRENT_DIR, "ai_generated")
 PROJECT_ROOT_DIR: Final[str] = _CURRENT_DIR
+RUN_STORE_PATH: Final[str] = os.path.join(_CURRENT_DIR, "pygen_runs.db")
+SEARCH_CACHE_PATH: Final[str] = os.path.join(_CURRENT_DIR, "pygen_search_cache.db")
+SEMANTIC_CACHE_PATH: Final[str] = os.path.join(_CURRENT_DIR, "pygen_semantic_cache.db")
 SYSTEM_MESSAGES_DIR: Final[str] = os.path.join(_CURRENT_DIR, "system_messages")
 
 # Define OS constants.
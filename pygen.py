@@ -4,23 +4,30 @@
 import argparse
 import json
 import logging
+import math
 import os
-from typing import Final, final
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Final, final
 
-import requests
 from azure.core.credentials import AzureKeyCredential
 from azure.search.documents import SearchClient
 from openai.lib.azure import AzureOpenAI
-from requests.auth import HTTPBasicAuth
 
-from definitions import ChatEntry, ChatHistory, OUTPUT_DIR
-from util import AzureOpenAIChatCompletions, AzureOpenAIModels, AzureSearchIndex, AzureSearchIndexes
-from util import ChatEntries, EnvVariables, Logger, SystemMessages
+from definitions import ChatHistory, Embeddings, OUTPUT_DIR, RUN_STORE_PATH, SEARCH_CACHE_PATH, SEMANTIC_CACHE_PATH
+from util import AzureOpenAIBatches, AzureOpenAIChatCompletions, AzureOpenAIClientPool, AzureOpenAIEmbeddings
+from util import AzureOpenAIModels, AzureSearchCache, AzureSearchIndex, AzureSearchIndexes, AzureSearchVectorModes
+from util import ChatEntries, EnvVariables, JiraApi, JiraTicketEnricher, LatencyPolicy, Logger, OutputFormats
+from util import OutputSink, PromptRegistry, RunMetrics, RunStages, RunStore, SemanticCache, SystemMessages
+from util import TokenChunker
 
-# Initialize the Azure OpenAI client.
+# Initialize the Azure OpenAI client, or a client pool if one is configured.
 API_VERSION: Final[str] = "2024-12-01-preview"
-OPENAI_CLIENT: Final[AzureOpenAI] = AzureOpenAI(azure_endpoint=EnvVariables.AZURE_OPENAI_ENDPOINT,
-                                                api_key=EnvVariables.AZURE_OPENAI_API_KEY, api_version=API_VERSION)
+OPENAI_CLIENT: Final[AzureOpenAI | AzureOpenAIClientPool] = (
+    AzureOpenAIClientPool.from_file(EnvVariables.AZURE_OPENAI_POOL_CONFIG, api_version=API_VERSION)
+    if EnvVariables.AZURE_OPENAI_POOL_CONFIG else
+    AzureOpenAI(azure_endpoint=EnvVariables.AZURE_OPENAI_ENDPOINT, api_key=EnvVariables.AZURE_OPENAI_API_KEY,
+                api_version=API_VERSION))
 
 # Initialize the Search client.
 SEARCH_CLIENT: Final[SearchClient] = SearchClient(endpoint=EnvVariables.AZURE_SEARCH_SERVICE_ENDPOINT,
@@ -28,7 +35,18 @@ SEARCH_CLIENT: Final[SearchClient] = SearchClient(endpoint=EnvVariables.AZURE_SE
                                                   credential=AzureKeyCredential(EnvVariables.AZURE_SEARCH_KEY))
 
 # Define the dev system message.
-DEV_SYSTEM_MESSAGE: Final[str] = SystemMessages.TYPESCRIPT_API_DEV_MESSAGE
+DEV_SYSTEM_MESSAGE: Final[SystemMessages] = SystemMessages.TYPESCRIPT_API_DEV_MESSAGE
+
+# Define the instructions for generating code, which are the same for every ticket.
+CODE_INSTRUCTIONS: Final[str] = "Generate code for the test cases."
+
+# Define the maximum number of tokens in a few-shot example from a similar ticket.
+FEW_SHOT_MAX_TOKENS: Final[int] = 2000
+
+# Define the options that change the output of a run, which a resumed run must be given again unchanged.
+RUN_OPTIONS: Final[list[str]] = ["enrich", "enrich_tokens", "fallback_models", "field", "helper_methods", "model",
+                                 "no_code", "no_test_cases", "output_folder", "output_format", "semantic_cache",
+                                 "similarity_threshold", "split", "vector_mode"]
 
 
 @final
@@ -37,7 +55,13 @@ class Globals:
     Class for managing global constants and instances across the entire application.
     """
     VERSION: Final[str] = "1.3.1"
+    code_latency_policy: LatencyPolicy
     options: argparse.Namespace
+    output_sink: OutputSink | None = None
+    run_id: str
+    run_store: RunStore
+    search_cache: AzureSearchCache | None = None
+    semantic_cache: SemanticCache | None = None
 
 
 def get_jira_ticket_info(ticket_id: str) -> str:
@@ -47,44 +71,169 @@ def get_jira_ticket_info(ticket_id: str) -> str:
     :return: The JIRA ticket information.
     :raises RuntimeError: If an error occurs while retrieving the JIRA ticket or if there is no ticket information.
     """
-    auth = HTTPBasicAuth(EnvVariables.JIRA_API_USERNAME, EnvVariables.JIRA_API_TOKEN)
     field = "description" if not Globals.options.field else Globals.options.field[0]
-    url = f"{EnvVariables.JIRA_API_ENDPOINT}/{ticket_id}?fields={field}"
 
-    # Get the JIRA ticket.
-    Logger.info(f"Retrieving ticket information for '{ticket_id}' from field '{field}'...")
-    response = requests.get(url=url, auth=auth)
+    # Get the JIRA ticket, with its references and comments if it is enriched.
+    Logger.info("Retrieving ticket information for '%s' from field '%s'...", ticket_id, field)
+    data = JiraApi.get_issue(ticket_id, fields=get_jira_ticket_fields(field))
+
+    if "fields" not in data:
+        raise RuntimeError(f"JIRA ticket {ticket_id} does not contain the field '{field}'.")
+
+    if not data["fields"].get(field):
+        raise RuntimeError(f"No ticket information for '{ticket_id}' from field '{field}'")
+
+    ticket_info = get_jira_ticket_context(data, field)
+
+    Logger.debug("Ticket information for '%s':\n%s", ticket_id, ticket_info)
+
+    return ticket_info
+
 
-    # If the request was successful, the status code will be 200.
-    if response.status_code != 200:
-        raise RuntimeError(f"Error retrieving JIRA ticket {ticket_id}. API response: {response.status_code}")
+def find_similar_ticket(ticket_id: str, ticket_info: str) -> tuple[Embeddings, dict | None]:
+    """
+    Embeds the ticket information and finds the most similar ticket in the semantic cache.
+    :param ticket_id: The JIRA ticket id.
+    :param ticket_info: The JIRA ticket information.
+    :return: The embedding of the ticket information, and the outputs of the most similar ticket if its similarity is
+    at least the threshold and it has the outputs needed.
+    """
+    mode = Globals.options.semantic_cache
+    threshold = 0.95 if not Globals.options.similarity_threshold else Globals.options.similarity_threshold[0]
+    vector = AzureOpenAIEmbeddings.generate(OPENAI_CLIENT, model=AzureOpenAIModels.TEXT_EMBEDDING_ADA_002,
+                                            text=ticket_info, max_chunks=1)[0]
+    match = Globals.semantic_cache.find(vector, exclude=ticket_id)
+
+    if match is None:
+        Logger.info("No earlier tickets to compare %s with.", ticket_id)
+        return vector, None
+
+    similar_ticket_id, output, score = match
+
+    if score < threshold:
+        Logger.info("Generating %s; the most similar ticket, %s, has a similarity of %.3f.", ticket_id,
+                    similar_ticket_id, score)
+        return vector, None
+
+    # Reusing needs every output this run would generate.
+    if mode == "reuse" and ((not Globals.options.no_test_cases and output["test_cases"] is None) or
+                            (not Globals.options.no_code and output["code"] is None)):
+        Logger.info("Generating %s; the similar ticket %s (similarity %.3f) does not have the outputs to reuse.",
+                    ticket_id, similar_ticket_id, score)
+        return vector, None
+
+    if mode == "reuse":
+        Logger.info("Reusing the output of %s for %s (similarity %.3f).", similar_ticket_id, ticket_id, score)
     else:
-        data = response.json()
+        Logger.info("Using %s as a few-shot example for %s (similarity %.3f).", similar_ticket_id, ticket_id, score)
 
-        if "fields" not in data:
-            raise RuntimeError(f"JIRA ticket {ticket_id} does not contain the field '{field}'.")
+    return vector, output
 
-        ticket_info = data["fields"][field]
 
-    if not ticket_info:
-        raise RuntimeError(f"No ticket information for '{ticket_id}' from field '{field}'")
+def get_jira_ticket_context(issue: dict, field: str) -> str:
+    """
+    Returns the ticket information of a JIRA ticket, enriched with its subtasks, linked issues and comments if --enrich
+    is given.
+    :param issue: The JIRA issue, retrieved with the fields from get_jira_ticket_fields.
+    :param field: The ticket information field.
+    :return: The ticket information.
+    """
+    if not Globals.options.enrich:
+        return issue["fields"][field]
 
-    Logger.debug(f"Ticket information for '{ticket_id}':\n{ticket_info}")
+    max_tokens = 4000 if not Globals.options.enrich_tokens else Globals.options.enrich_tokens[0]
 
-    return ticket_info
+    return JiraTicketEnricher.enrich(issue, field=field, depth=Globals.options.enrich[0], max_tokens=max_tokens)
 
 
-def get_system_message_from_file(file_name: str) -> ChatEntry:
+def get_jira_ticket_fields(field: str) -> list[str]:
     """
-    Returns a system message from a file.
-    :param file_name: The file path.
-    :return: A system message.
+    Returns the fields to retrieve for a JIRA ticket.
+    :param field: The ticket information field.
+    :return: The fields.
     """
-    # Read in the content replacing all newlines with a space.
-    with open(file_name, 'r') as file:
-        content = file.read().replace("\n", " ").rstrip()
+    return [field, *JiraTicketEnricher.FIELDS] if Globals.options.enrich else [field]
 
-    return ChatEntries.as_system(content)
+
+def initialize_latency_policy() -> None:
+    """
+    Initializes the latency policy for generating code.
+    :return: None
+    """
+    model = AzureOpenAIModels.GPT_4 if not Globals.options.model else Globals.options.model[0]
+    fallback_models = Globals.options.fallback_models if Globals.options.fallback_models else []
+    hedge_delay = Globals.options.hedge_delay[0] if Globals.options.hedge_delay else None
+    hedge_percentile = Globals.options.hedge_percentile[0] if Globals.options.hedge_percentile else None
+    timeout = Globals.options.timeout[0] if Globals.options.timeout else None
+
+    Globals.code_latency_policy = LatencyPolicy(models=[model, *fallback_models], hedge_delay=hedge_delay,
+                                                hedge_percentile=hedge_percentile, timeout=timeout)
+
+
+def load_latencies() -> None:
+    """
+    Loads the code generation latencies saved by earlier runs, so a learned hedge delay is available from the first
+    ticket. The latencies are kept for the primary model, whose requests the hedge delay applies to.
+    :return: None
+    """
+    policy = Globals.code_latency_policy
+    policy.add_latencies(Globals.run_store.get_latencies(policy.models[0]))
+
+
+def save_latencies() -> None:
+    """
+    Saves the code generation latencies for later runs, unless there are none (e.g. the run failed to start).
+    :return: None
+    """
+    policy = Globals.code_latency_policy
+    latencies = policy.get_latencies()
+
+    if latencies:
+        Globals.run_store.save_latencies(policy.models[0], latencies)
+
+
+def get_run_options() -> dict[str, Any]:
+    """
+    Returns the options that change the output of a run, to save with the run.
+    :return: The option values by name.
+    """
+    return {name: getattr(Globals.options, name) for name in RUN_OPTIONS}
+
+
+def initialize_run_store() -> None:
+    """
+    Initializes the run store, creating a new run or resuming the run given with --resume.
+    :return: None
+    :raises RuntimeError: If the run to resume does not exist or was started with different options.
+    """
+    Globals.run_store = RunStore(RUN_STORE_PATH)
+
+    if Globals.options.resume:
+        Globals.run_id = Globals.options.resume[0]
+        run_options = Globals.run_store.get_run_options(Globals.run_id)
+
+        if run_options is None:
+            raise RuntimeError(f"Run {Globals.run_id} does not exist.")
+
+        # Do not mix the saved stage outputs with outputs generated under other options.
+        saved_options = run_options.get("options", {})
+        changed_options = [name for name, value in saved_options.items()
+                           if getattr(Globals.options, name, value) != value]
+
+        if changed_options:
+            started_with = ", ".join(f"{name} {json.dumps(saved_options[name])}" for name in changed_options)
+            raise RuntimeError(f"Run {Globals.run_id} was started with other options ({started_with}); resume it with "
+                               f"the same options.")
+
+        # Resume the run's tickets unless tickets were given.
+        if not Globals.options.ticket:
+            Globals.options.ticket = run_options["tickets"]
+
+        Logger.info("Resuming run %s.", Globals.run_id)
+    else:
+        Globals.run_id = Globals.run_store.create_run({"tickets": Globals.options.ticket,
+                                                       "options": get_run_options()})
+        Logger.info("Starting run %s; resume it with '--resume %s' if interrupted.", Globals.run_id, Globals.run_id)
 
 
 def initialize_logger() -> None:
@@ -105,13 +254,182 @@ def initialize_logger() -> None:
             log_level = logging.WARNING
 
     # Initialize the logger.
-    logging.basicConfig(format="%(message)s", level=log_level)
+    Logger.initialize(log_level, json_format=Globals.options.log_format == "json")
+
+
+def log_client_pool_stats() -> None:
+    """
+    Logs the per-endpoint statistics if a client pool is configured.
+    :return: None
+    """
+    if not isinstance(OPENAI_CLIENT, AzureOpenAIClientPool):
+        return
+
+    for stats in OPENAI_CLIENT.get_stats():
+        Logger.info("Endpoint '%s': %s requests, %s successes, %s throttles, %s errors, %s ejections, %.2fs mean "
+                    "latency", stats["endpoint"], stats["requests"], stats["successes"], stats["throttles"],
+                    stats["errors"], stats["ejections"], stats["mean_latency"])
+
+
+def log_run_metrics() -> None:
+    """
+    Logs the run metrics.
+    :return: None
+    """
+    for name, value in RunMetrics.get().items():
+        Logger.info("Metric %s: %g", name, value)
+
+
+def log_search_cache_stats() -> None:
+    """
+    Logs the search cache hits and misses if the search cache is used.
+    :return: None
+    """
+    if not Globals.search_cache:
+        return
+
+    stats = Globals.search_cache.get_stats()
+    Logger.info("Search cache: %s hits, %s misses", stats["hits"], stats["misses"])
+
+
+def create_batch_client() -> AzureOpenAI:
+    """
+    Creates the Azure OpenAI client for the Batch API, which can point to a separate (e.g. local) endpoint.
+    :return: The Azure OpenAI client.
+    :raises RuntimeError: If no endpoint or API key is set for the Batch API.
+    """
+    endpoint = EnvVariables.AZURE_OPENAI_BATCH_ENDPOINT or EnvVariables.AZURE_OPENAI_ENDPOINT
+
+    # A client pool does not need these variables, so they are only checked when bulk mode is used.
+    if not endpoint or not EnvVariables.AZURE_OPENAI_API_KEY:
+        raise RuntimeError("Bulk mode requires AZURE_OPENAI_API_KEY and either AZURE_OPENAI_BATCH_ENDPOINT or "
+                           "AZURE_OPENAI_ENDPOINT to be set.")
+
+    return AzureOpenAI(azure_endpoint=endpoint, api_key=EnvVariables.AZURE_OPENAI_API_KEY, api_version=API_VERSION)
+
+
+def close_output_sink() -> None:
+    """
+    Closes the output sink, if open, which syncs the buffered output and records the output stage of its tickets.
+    :return: None
+    """
+    if Globals.output_sink:
+        try:
+            Globals.output_sink.close()
+        except Exception as exception:
+            Logger.error("error: %s", exception)
+        finally:
+            Globals.output_sink = None
+
+
+def create_output_sink() -> OutputSink:
+    """
+    Creates the output sink for the output format and folder options.
+    :return: The output sink.
+    """
+    output_folder = OUTPUT_DIR if not Globals.options.output_folder else Globals.options.output_folder[0]
+
+    return OutputSink.create(OutputFormats(Globals.options.output_format), output_folder)
+
+
+def create_code_chat_history(test_cases: str, helper_methods: str, example: dict | None = None) -> ChatHistory:
+    """
+    Returns the chat history for generating code.
+    :param test_cases: The test cases.
+    :param helper_methods: The helper methods.
+    :param example: The outputs of a similar ticket to use as a few-shot example. The default value is none.
+    :return: The chat history.
+    """
+    # Add the DEV system message, instructions, helper methods and test cases to the chat history. The content shared
+    # by every ticket comes first, so it forms the same prefix in every request and can be served from the prompt cache.
+    request = f"{CODE_INSTRUCTIONS}\nHelper Methods: {helper_methods}\nTest Cases: {test_cases}"
+    few_shot_example = create_few_shot_example(
+        f"{CODE_INSTRUCTIONS}\nTest Cases: {example['test_cases'] or example['ticket_info']}", example["code"]
+    ) if example else []
+
+    return [ChatEntries.as_system(PromptRegistry.get(DEV_SYSTEM_MESSAGE)), *few_shot_example,
+            ChatEntries.as_user(request)]
+
+
+def create_few_shot_example(request: str, response: str | None) -> ChatHistory:
+    """
+    Returns the chat history for a few-shot example.
+    :param request: The example request.
+    :param response: The example response.
+    :return: The chat history, which is empty if there is no response or the example has more than
+    FEW_SHOT_MAX_TOKENS tokens.
+    """
+    if not response or TokenChunker.count_tokens(request) + TokenChunker.count_tokens(response) > FEW_SHOT_MAX_TOKENS:
+        return []
+
+    return [ChatEntries.as_user(request), ChatEntries.as_assistant(response)]
+
+
+def create_test_cases_chat_history(ticket_info: str, example: dict | None = None) -> ChatHistory:
+    """
+    Returns the chat history for generating test cases.
+    :param ticket_info: The JIRA ticket information.
+    :param example: The outputs of a similar ticket to use as a few-shot example. The default value is none.
+    :return: The chat history.
+    """
+    few_shot_example = create_few_shot_example(example["ticket_info"], example["test_cases"]) if example else []
+
+    # Add the QA system message and the JIRA ticket information to the chat history.
+    return [ChatEntries.as_system(PromptRegistry.get(SystemMessages.QA_MESSAGE)), *few_shot_example,
+            ChatEntries.as_user(ticket_info)]
+
+
+def generate_for_ticket(ticket_id: str, ticket_info: str | None = None) -> None:
+    """
+    Generates and saves the test cases and code for a JIRA ticket.
+    :param ticket_id: The JIRA ticket id.
+    :param ticket_info: The JIRA ticket information if it was already retrieved. The default value is none.
+    :return: None
+    """
+    # Already saved in the run being resumed?
+    if Globals.run_store.get_stage(Globals.run_id, ticket_id, RunStages.OUTPUT) is not None:
+        Logger.info("Skipping %s; its output was already saved in run %s.", ticket_id, Globals.run_id)
+        return
+
+    ticket_info = run_stage(ticket_id, RunStages.TICKET_INFO,
+                            lambda: ticket_info if ticket_info else get_jira_ticket_info(ticket_id))
+
+    # Find an earlier ticket that is almost the same.
+    vector, similar = find_similar_ticket(ticket_id, ticket_info) if Globals.semantic_cache else (None, None)
+    reuse = similar is not None and Globals.options.semantic_cache == "reuse"
+
+    # Skip test cases?
+    if Globals.options.no_test_cases:
+        Logger.info("Skipping test case generation.")
+        test_cases = ticket_info
+    elif reuse:
+        test_cases = run_stage(ticket_id, RunStages.TEST_CASES, lambda: similar["test_cases"])
+    else:
+        test_cases = run_stage(ticket_id, RunStages.TEST_CASES, lambda: run_conversation_for_test_cases(
+            create_test_cases_chat_history(ticket_info, similar)))
+
+    # Skip code?
+    if Globals.options.no_code:
+        Logger.info("Skipping code generation.")
+        code = None
+    elif reuse:
+        code = run_stage(ticket_id, RunStages.CODE, lambda: similar["code"])
+    else:
+        helper_methods = run_stage(ticket_id, RunStages.HELPER_METHODS,
+                                   lambda: search_for_helper_methods(test_cases))
+        code = run_stage(ticket_id, RunStages.CODE, lambda: run_conversation_for_code(
+            create_code_chat_history(test_cases, helper_methods, similar)))
 
-    # Set log levels for imported modules to ERROR.
-    modules = ["azure", "httpcore", "httpx", "openai", "urllib3"]
+    # Save the test cases and code, and record the output stage only once the sink has synced them to disk.
+    run_id = Globals.run_id
+    save_output(ticket_id, ticket_info, test_cases, code,
+                on_saved=lambda: Globals.run_store.save_stage(run_id, ticket_id, RunStages.OUTPUT, "", 0))
 
-    for module in modules:
-        logging.getLogger(module).setLevel(logging.ERROR)
+    # Add the generated output to the semantic cache for later tickets.
+    if vector is not None and not reuse:
+        Globals.semantic_cache.add(ticket_id, vector, {
+            "ticket_info": ticket_info, "test_cases": None if Globals.options.no_test_cases else test_cases,
+            "code": code})
 
 
 def main() -> None:
@@ -121,41 +439,54 @@ def main() -> None:
     """
     parse_arguments()
     initialize_logger()
+    initialize_latency_policy()
 
     try:
-        # Get the JIRA ticket id and information.
-        ticket_id = Globals.options.ticket[0]
-        ticket_info = get_jira_ticket_info(ticket_id)
-
-        # Skip test cases?
-        if Globals.options.no_test_cases:
-            Logger.info("Skipping test case generation.")
-            test_cases = ticket_info
+        # Reuse the helper method results of earlier searches unless the index has changed.
+        if not Globals.options.no_search_cache:
+            max_entries = 1000 if not Globals.options.search_cache_size else Globals.options.search_cache_size[0]
+            Globals.search_cache = AzureSearchCache(SEARCH_CACHE_PATH, max_entries=max_entries)
+
+        if Globals.options.semantic_cache:
+            Globals.semantic_cache = SemanticCache(SEMANTIC_CACHE_PATH)
+
+        if Globals.options.bulk:
+            Globals.output_sink = create_output_sink()
+            run_bulk(Globals.options.bulk[0])
+        elif Globals.options.watch:
+            Globals.run_store = RunStore(RUN_STORE_PATH)
+            load_latencies()
+            run_watch(Globals.options.watch[0])
         else:
-            # Add the QA system message and the JIRA ticket information to the chat history.
-            chat_history = [get_system_message_from_file(SystemMessages.QA_MESSAGE), ChatEntries.as_user(ticket_info)]
-
-            # Generate test cases.
-            test_cases = run_conversation_for_test_cases(chat_history)
+            initialize_run_store()
+            load_latencies()
+            Globals.output_sink = create_output_sink()
+
+            for ticket_id in Globals.options.ticket:
+                with Logger.context(ticket=ticket_id):
+                    try:
+                        generate_for_ticket(ticket_id)
+                    except Exception as exception:
+                        Logger.error("error: %s", exception)
+    except Exception as exception:
+        Logger.error("error: %s", exception)
+    finally:
+        # Flush the buffered output, then commit the completed stages, even if the run was interrupted.
+        close_output_sink()
 
-        # Skip code?
-        if Globals.options.no_code:
-            Logger.info("Skipping code generation.")
-            code = None
-        else:
-            helper_methods = search_for_helper_methods(test_cases)
+        if hasattr(Globals, "run_store"):
+            save_latencies()
+            Globals.run_store.close()
 
-            # Add the DEV system message, test cases and helper methods to the chat history.
-            request = f"Generate code for the test cases.\nTest Cases: {test_cases}\nHelper Methods: {helper_methods}"
-            chat_history = [get_system_message_from_file(DEV_SYSTEM_MESSAGE), ChatEntries.as_user(request)]
+        log_client_pool_stats()
+        log_search_cache_stats()
+        log_run_metrics()
 
-            # Generate code.
-            code = run_conversation_for_code(chat_history)
+        if Globals.search_cache:
+            Globals.search_cache.close()
 
-        # Save the test cases and code.
-        save_output(ticket_id, ticket_info, test_cases, code)
-    except Exception as exception:
-        Logger.error(f"error: {exception}")
+        if Globals.semantic_cache:
+            Globals.semantic_cache.close()
 
 
 def parse_arguments() -> None:
@@ -164,25 +495,185 @@ def parse_arguments() -> None:
     :return: None
     """
     parser = argparse.ArgumentParser(allow_abbrev=False,
-                                     description="utility for generating test cases from jira tickets")
+                                     description="utility for generating test cases from jira tickets",
+                                     fromfile_prefix_chars="@")
     generate = parser.add_mutually_exclusive_group()
 
     generate.add_argument("--no-code", action="store_true", help="do not generate code")
     generate.add_argument("--no-test-cases", action="store_true", help="do not generate test cases")
+    parser.add_argument("--debounce", help="the seconds a ticket must go unedited before generating in watch mode",
+                        metavar="seconds", nargs=1, type=float)
+    parser.add_argument("--enrich-tokens", help="the token budget for enriched ticket information", metavar="tokens",
+                        nargs=1, type=int)
+    parser.add_argument("--hedge-delay", help="the seconds to wait before hedging to a fallback model",
+                        metavar="seconds", nargs=1, type=float)
+    parser.add_argument("--hedge-percentile", help="the learned latency percentile to wait before hedging",
+                        metavar="percentile", nargs=1, type=float)
+    parser.add_argument("--interval", help="the seconds between jira polls in watch mode", metavar="seconds", nargs=1,
+                        type=float)
+    parser.add_argument("--log-format", choices=["text", "json"], default="text",
+                        help="write logs as colored text or json lines")
+    parser.add_argument("--no-search-cache", action="store_true", help="always search instead of reusing cached "
+                                                                       "helper method results")
+    parser.add_argument("--poll-interval", help="the seconds between batch status checks in bulk mode",
+                        metavar="seconds", nargs=1, type=float)
+    parser.add_argument("--resume", help="resume an interrupted run, skipping the stages already done",
+                        metavar="run-id", nargs=1)
+    parser.add_argument("--search-cache-size", help="the number of helper method searches to cache",
+                        metavar="entries", nargs=1, type=int)
+    parser.add_argument("--semantic-cache", choices=["reuse", "few-shot"],
+                        help="reuse the output of a similar ticket or use it as an example")
+    parser.add_argument("--similarity-threshold", help="the cosine similarity for a ticket to count as similar",
+                        metavar="threshold", nargs=1, type=float)
+    parser.add_argument("--vector-mode", choices=[vector_mode.value for vector_mode in AzureSearchVectorModes],
+                        default=AzureSearchVectorModes.FIRST_CHUNK.value,
+                        help="embed the first chunk of long queries, or every chunk as multiple vectors or fused "
+                             "searches")
+    parser.add_argument("-F", "--fallback-models", help="the models to hedge and fall back to when generating code",
+                        metavar="models", nargs="+")
     parser.add_argument("-H", "--helper-methods", help="the number of helper methods to query for", metavar="methods",
                         nargs=1, type=int)
+    parser.add_argument("-O", "--output-format", choices=[output_format.value for output_format in OutputFormats],
+                        default=OutputFormats.FILES.value, help="the output format: %(choices)s", metavar="format")
+    parser.add_argument("-T", "--timeout", help="the seconds to wait for a model before falling back",
+                        metavar="seconds", nargs=1, type=float)
+    parser.add_argument("-b", "--bulk", help="generate offline with the batch api, keeping state in folder",
+                        metavar="folder", nargs=1)
+    parser.add_argument("-e", "--enrich", help="add linked issues and comments up to depth levels to the ticket",
+                        metavar="depth", nargs=1, type=int)
     parser.add_argument("-f", "--field", help="the jira ticket qa field", metavar="field", nargs=1)
     parser.add_argument("-l", "--log-level", choices=["debug", "info", "warning", "error"], default="info",
                         help="set the log level")
     parser.add_argument("-m", "--model", help="the model to use for generating code", metavar="model", nargs=1)
     parser.add_argument("-o", "--output-folder", help="the output folder", metavar="folder", nargs=1)
     parser.add_argument("-s", "--split", action="store_true", help="split test cases and code into separate files")
-    parser.add_argument("-t", "--ticket", help="the jira ticket id", metavar="ticket", nargs=1, required=True)
+    parser.add_argument("-t", "--ticket", help="the jira ticket ids, or @file to read them from a file",
+                        metavar="ticket", nargs="+")
+    parser.add_argument("-w", "--watch", help="poll a jql filter and generate for the tickets as they are updated",
+                        metavar="jql", nargs=1)
     parser.add_argument("-v", "--version", action="version", version=f"%(prog)s {Globals.VERSION}")
 
     # Parse the arguments.
     Globals.options = parser.parse_args()
 
+    # The tickets of a resumed run are stored with the run, and watched tickets come from the filter.
+    if Globals.options.watch:
+        if Globals.options.ticket or Globals.options.resume or Globals.options.bulk:
+            parser.error("argument -w/--watch: not allowed with arguments -t/--ticket, --resume or -b/--bulk")
+    elif not Globals.options.ticket and not Globals.options.resume:
+        parser.error("the following arguments are required: -t/--ticket")
+
+    if Globals.options.hedge_percentile and not 0 < Globals.options.hedge_percentile[0] < 100:
+        parser.error("argument --hedge-percentile: must be between 0 and 100")
+
+    if Globals.options.bulk and Globals.options.semantic_cache:
+        parser.error("argument --semantic-cache: not allowed with argument -b/--bulk")
+
+    if Globals.options.bulk and Globals.options.resume:
+        parser.error("argument --resume: not allowed with argument -b/--bulk; bulk runs resume from their folder")
+
+
+def run_bulk(folder: str) -> None:
+    """
+    Generates test cases and code for the JIRA tickets offline with the Batch API. Each phase is saved to JSONL files in
+    the folder, so an interrupted bulk run resumes where it stopped when run again with the same folder.
+    :param folder: The folder for the bulk run files.
+    :return: None
+    """
+    batch_client = create_batch_client()
+    os.makedirs(folder, exist_ok=True)
+    poll_interval = 60 if not Globals.options.poll_interval else Globals.options.poll_interval[0]
+    tickets = read_jsonl(os.path.join(folder, "tickets.jsonl"), key="ticket_id")
+
+    # Get the JIRA ticket information for the tickets not already fetched.
+    with open(os.path.join(folder, "tickets.jsonl"), encoding="utf-8", mode="a") as file:
+        for ticket_id in Globals.options.ticket:
+            if ticket_id in tickets:
+                continue
+
+            try:
+                tickets[ticket_id] = {"ticket_id": ticket_id, "ticket_info": get_jira_ticket_info(ticket_id)}
+            except Exception as exception:
+                Logger.error("error: %s", exception)
+                continue
+
+            file.write(f"{json.dumps(tickets[ticket_id])}\n")
+            file.flush()
+
+    # Generate test cases.
+    if Globals.options.no_test_cases:
+        Logger.info("Skipping test case generation.")
+        test_cases = {ticket_id: ticket["ticket_info"] for ticket_id, ticket in tickets.items()}
+    else:
+        model = AzureOpenAIModels.GPT_35T
+        Logger.info("Generating test cases for %s tickets with batch model '%s'...", len(tickets), model)
+        test_cases = AzureOpenAIBatches.run(batch_client, custom_ids=list(tickets), create_request=lambda ticket_id: (
+            AzureOpenAIBatches.create_request(
+                ticket_id, model=model,
+                chat_history=create_test_cases_chat_history(tickets[ticket_id]["ticket_info"]))),
+                                            file_prefix=os.path.join(folder, "test-cases"),
+                                            poll_interval=poll_interval)
+
+        for ticket_id in tickets:
+            if ticket_id not in test_cases:
+                Logger.error("error: No test cases were generated for %s.", ticket_id)
+
+    # Generate code.
+    if Globals.options.no_code:
+        Logger.info("Skipping code generation.")
+        code = {}
+    else:
+        helper_methods = read_jsonl(os.path.join(folder, "helper-methods.jsonl"), key="ticket_id")
+
+        # Search for the helper methods for the test cases not already searched.
+        with open(os.path.join(folder, "helper-methods.jsonl"), encoding="utf-8", mode="a") as file:
+            for ticket_id, ticket_test_cases in test_cases.items():
+                if ticket_id not in helper_methods:
+                    helper_methods[ticket_id] = {"ticket_id": ticket_id,
+                                                 "helper_methods": search_for_helper_methods(ticket_test_cases)}
+                    file.write(f"{json.dumps(helper_methods[ticket_id])}\n")
+                    file.flush()
+
+        model = Globals.code_latency_policy.models[0]
+        Logger.info("Generating code for %s tickets with batch model '%s'...", len(test_cases), model)
+        code = AzureOpenAIBatches.run(batch_client, custom_ids=list(test_cases), create_request=lambda ticket_id: (
+            AzureOpenAIBatches.create_request(
+                ticket_id, model=model, temperature=0.2, top_p=0.1,
+                chat_history=create_code_chat_history(test_cases[ticket_id],
+                                                      helper_methods[ticket_id]["helper_methods"]))),
+                                      file_prefix=os.path.join(folder, "code"), poll_interval=poll_interval)
+
+    # Save the test cases and code.
+    for ticket_id in test_cases:
+        if not Globals.options.no_code and ticket_id not in code:
+            Logger.error("error: No code was generated for %s.", ticket_id)
+            continue
+
+        save_output(ticket_id, tickets[ticket_id]["ticket_info"], test_cases[ticket_id], code.get(ticket_id))
+
+
+def read_jsonl(file_name: str, *, key: str) -> dict[str, dict]:
+    """
+    Reads the records of a JSONL file.
+    :param file_name: The file path.
+    :param key: The record field to index the records by.
+    :return: The records by key, or an empty dictionary if the file does not exist.
+    """
+    records = {}
+
+    if os.path.exists(file_name):
+        with open(file_name, encoding="utf-8", mode="r") as file:
+            for line in file:
+                # Skip a partially written last line from an interrupted run.
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+                records[record[key]] = record
+
+    return records
+
 
 def run_conversation_for_code(chat_history: ChatHistory) -> str:
     """
@@ -190,13 +681,15 @@ def run_conversation_for_code(chat_history: ChatHistory) -> str:
     :param chat_history: The chat history.
     :return: The response message and chat history.
     """
-    model = AzureOpenAIModels.GPT_4 if not Globals.options.model else Globals.options.model[0]
-
-    Logger.info(f"Generating code with model '{model}'...")
-    Logger.debug(f"Calling the chat completions API for code with:\n{json.dumps(chat_history)}")
-    code = AzureOpenAIChatCompletions.run_conversation(OPENAI_CLIENT, model=model, chat_history=chat_history,
-                                                       temperature=0.2, top_p=0.1).content
-    Logger.debug(f"Chat completions response:\n{code}\n")
+    policy = Globals.code_latency_policy
+
+    Logger.info("Generating code with model '%s'...", policy.models[0])
+    Logger.debug("The system message is %s tokens.", Logger.lazy(PromptRegistry.count_tokens, DEV_SYSTEM_MESSAGE))
+    Logger.debug("Calling the chat completions API for code with:\n%s", Logger.lazy(json.dumps, chat_history))
+    code = AzureOpenAIChatCompletions.run_conversation_with_policy(OPENAI_CLIENT, policy=policy,
+                                                                   chat_history=chat_history, temperature=0.2,
+                                                                   top_p=0.1).content
+    Logger.debug("Chat completions response:\n%s\n", code)
     Logger.info("Code generation complete.")
 
     return code
@@ -210,63 +703,174 @@ def run_conversation_for_test_cases(chat_history: ChatHistory) -> str:
     """
     model = AzureOpenAIModels.GPT_35T
 
-    Logger.info(f"Generating test cases with model '{model}'...")
-    Logger.debug(f"Calling the chat completions API for test cases with:\n{json.dumps(chat_history)}")
+    Logger.info("Generating test cases with model '%s'...", model)
+    Logger.debug("The system message is %s tokens.",
+                 Logger.lazy(PromptRegistry.count_tokens, SystemMessages.QA_MESSAGE))
+    Logger.debug("Calling the chat completions API for test cases with:\n%s",
+                 Logger.lazy(json.dumps, chat_history))
     test_cases = AzureOpenAIChatCompletions.run_conversation(OPENAI_CLIENT, model=model,
                                                              chat_history=chat_history).content
-    Logger.debug(f"Chat completions response:\n{test_cases}\n")
+    Logger.debug("Chat completions response:\n%s\n", test_cases)
     Logger.info("Test case generation complete.")
 
     return test_cases
 
 
-def save_output(jira_ticket: str, ticket_info: str, test_cases: str, code: str) -> None:
+def run_stage(ticket_id: str, stage: RunStages, function: Callable[[], str]) -> str:
+    """
+    Runs a stage for a ticket and saves its output to the run store, or returns the saved output if the stage was
+    already done in the run being resumed.
+    :param ticket_id: The JIRA ticket id.
+    :param stage: The stage.
+    :param function: The function that runs the stage and returns its output.
+    :return: The stage output.
     """
-    Saves the AI generated test cases and code to file.
+    output = Globals.run_store.get_stage(Globals.run_id, ticket_id, stage)
+
+    if output is not None:
+        Logger.info("Resuming %s with the saved %s.", ticket_id, stage.value.replace("_", " "))
+        return output
+
+    start = time.perf_counter()
+
+    with Logger.context(stage=stage.value):
+        output = function()
+
+    Globals.run_store.save_stage(Globals.run_id, ticket_id, stage, output, time.perf_counter() - start)
+
+    return output
+
+
+def run_watch(jql: str) -> None:
+    """
+    Polls the JQL filter for updated tickets and generates test cases and code for each one once it has gone unedited
+    for the debounce period. Polls request only the key and updated time; the ticket information is retrieved just for
+    the tickets about to be generated. The watermark is saved in the run store, so a restarted watch continues where it
+    stopped. Runs until interrupted.
+    :param jql: The JQL filter, without an ORDER BY clause.
+    :return: None
+    """
+    debounce = 120 if not Globals.options.debounce else Globals.options.debounce[0]
+    field = "description" if not Globals.options.field else Globals.options.field[0]
+    interval = 300 if not Globals.options.interval else Globals.options.interval[0]
+    generated = {}  # The updated time generated for, by ticket id.
+    pending = {}  # The updated time and when it was first seen, by ticket id.
+    watermark = Globals.run_store.get_watermark(jql)
+
+    # Watch for updates from now on the first time the filter is watched.
+    if watermark is None:
+        watermark = datetime.now(timezone.utc).isoformat()
+        Globals.run_store.save_watermark(jql, watermark)
+
+    watermark = datetime.fromisoformat(watermark)
+    Logger.info("Watching '%s' for tickets updated after %s, polling every %gs...", jql, watermark, interval)
+
+    while True:
+        try:
+            # A relative JQL date does not depend on the time zone of the JIRA user; the extra minute covers clock skew.
+            minutes = math.ceil((datetime.now(timezone.utc) - watermark).total_seconds() / 60) + 1
+            issues = JiraApi.search(f"({jql}) AND updated >= \"-{minutes}m\" ORDER BY updated ASC", fields=["updated"])
+
+            for issue in issues:
+                ticket_id = issue["key"]
+                updated = datetime.fromisoformat(issue["fields"]["updated"])
+
+                # Restart the debounce period whenever the ticket is edited again.
+                if updated > watermark and generated.get(ticket_id) != updated and \
+                        (ticket_id not in pending or pending[ticket_id][0] != updated):
+                    pending[ticket_id] = (updated, time.monotonic())
+
+            ready = [ticket_id for ticket_id, (_, seen) in pending.items() if time.monotonic() - seen >= debounce]
+
+            if ready:
+                Globals.run_id = Globals.run_store.create_run({"tickets": ready, "options": get_run_options()})
+                Logger.info("Starting run %s for %s updated tickets.", Globals.run_id, len(ready))
+
+                # Get the ticket information for all the ready tickets at once.
+                issues = JiraApi.search(f"key in ({', '.join(ready)})", fields=get_jira_ticket_fields(field))
+                issues = {issue["key"]: issue for issue in issues}
+
+                # Use a sink for each run, so the output is synced once the tickets are generated instead of on exit.
+                Globals.output_sink = create_output_sink()
+
+                try:
+                    for ticket_id in ready:
+                        with Logger.context(ticket=ticket_id):
+                            try:
+                                if ticket_id not in issues or not issues[ticket_id]["fields"].get(field):
+                                    raise RuntimeError(f"No ticket information for '{ticket_id}' from field '{field}'")
+
+                                generate_for_ticket(ticket_id, get_jira_ticket_context(issues[ticket_id], field))
+                            except Exception as exception:
+                                Logger.error("error: %s", exception)
+
+                        # Do not retry a failed ticket until it is edited again.
+                        generated[ticket_id] = pending.pop(ticket_id)[0]
+                finally:
+                    close_output_sink()
+
+                # Keep the watermark just before the oldest pending update so no update is missed after a restart.
+                if pending:
+                    oldest = min(updated for updated, _ in pending.values()) - timedelta(milliseconds=1)
+                else:
+                    oldest = max(generated[ticket_id] for ticket_id in ready)
+
+                watermark = max(watermark, oldest)
+                Globals.run_store.save_watermark(jql, watermark.isoformat())
+        except Exception as exception:
+            Logger.error("error: %s", exception)
+
+        time.sleep(interval)
+
+
+def save_output(jira_ticket: str, ticket_info: str, test_cases: str, code: str, *,
+                on_saved: Callable[[], None] | None = None) -> None:
+    """
+    Saves the AI generated test cases and code to the output sink.
     :param jira_ticket: The JIRA ticket number.
     :param ticket_info: The JIRA ticket information.
     :param test_cases: The test cases.
     :param code: The code.
+    :param on_saved: A function to call once the output is synced to disk. The default value is none.
     :return: None
     """
-    encoding = "utf-8"
-    output_dir = OUTPUT_DIR if not Globals.options.output_folder else Globals.options.output[0]
-    output_file_path = os.path.join(output_dir, jira_ticket.lower())
-    output_file_test_cases = f"{output_file_path}-test-cases.txt"
+    output_file_test_cases = f"{jira_ticket.lower()}-test-cases.txt"
+    record = {"ticket_id": jira_ticket, "ticket_info": ticket_info, "test_cases": None, "code": code}
+    sink = Globals.output_sink
 
     # Write the test information.
-    with open(output_file_test_cases, encoding=encoding, mode="w") as text_file:
-        text_file.write(f"{jira_ticket}:\n---------\n{ticket_info}\n")
+    files = {output_file_test_cases: f"{jira_ticket}:\n---------\n{ticket_info}\n"}
 
     # Test cases generated?
     if not Globals.options.no_test_cases:
-        with open(output_file_test_cases, encoding=encoding, mode="a") as text_file:
-            text_file.write(f"\nTest Cases:\n-----------\n{test_cases}\n")
-
-        Logger.info(f"Test cases for {jira_ticket} saved to '{output_file_test_cases}'")
-    else:
-        Logger.info(f"Test information for {jira_ticket} saved to '{output_file_test_cases}'")
+        files[output_file_test_cases] += f"\nTest Cases:\n-----------\n{test_cases}\n"
+        record["test_cases"] = test_cases
 
     # Code generated?
     if not Globals.options.no_code:
         # Split test cases and code into separate files?
         if Globals.options.split:
-            output_file_code = f"{output_file_path}-code.test.ts"
+            output_file_code = f"{jira_ticket.lower()}-code.test.ts"
 
             # Trim the first and last non-compiling lines.
             code = code.replace("```typescript\n", "")
             code = code.replace("```", "")
 
-            # Write the code.
-            with open(output_file_code, encoding=encoding, mode="w") as text_file:
-                text_file.write(code)
-
-            Logger.info(f"Code for {jira_ticket} saved to '{output_file_code}'")
+            files[output_file_code] = code
         else:
-            with open(output_file_test_cases, encoding=encoding, mode="a") as text_file:
-                text_file.write(f"\nCode:\n-----\n{code}\n")
+            output_file_code = output_file_test_cases
+            files[output_file_test_cases] += f"\nCode:\n-----\n{code}\n"
 
-            Logger.info(f"Code for {jira_ticket} saved to '{output_file_test_cases}'")
+    # Write all the output for the ticket at once.
+    sink.write(files=files, record=record, on_saved=on_saved)
+
+    if not Globals.options.no_test_cases:
+        Logger.info("Test cases for %s saved to '%s'", jira_ticket, sink.get_location(output_file_test_cases))
+    else:
+        Logger.info("Test information for %s saved to '%s'", jira_ticket, sink.get_location(output_file_test_cases))
+
+    if not Globals.options.no_code:
+        Logger.info("Code for %s saved to '%s'", jira_ticket, sink.get_location(output_file_code))
 
 
 def search_for_helper_methods(test_cases: str) -> str:
@@ -278,14 +882,17 @@ def search_for_helper_methods(test_cases: str) -> str:
     helper_methods = []
     top_results = 5 if not Globals.options.helper_methods else Globals.options.helper_methods[0]
 
-    Logger.info(f"Searching for the top {top_results} helper methods...")
+    Logger.info("Searching for the top %s helper methods...", top_results)
+
+    vector_mode = AzureSearchVectorModes(Globals.options.vector_mode)
 
     for result in AzureSearchIndex.do_hybrid_search(OPENAI_CLIENT, SEARCH_CLIENT, query=test_cases,
-                                                    top_results=top_results):
+                                                    top_results=top_results, vector_mode=vector_mode,
+                                                    cache=Globals.search_cache):
         helper_methods.extend(method for method in result)
 
     helper_methods = "\n".join(helper_methods)
-    Logger.debug(f"Search response:\n{helper_methods}")
+    Logger.debug("Search response:\n%s", helper_methods)
     Logger.info("Search complete.")
 
     return helper_methods
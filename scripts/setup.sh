@@ -3,6 +3,7 @@
 # Install the required packages.
 pip3 install azure-search-documents==11.6.0b9 --upgrade --user "$@"
 pip3 install colorama --upgrade --user "$@"
+pip3 install numpy --upgrade --user "$@"
 pip3 install openai --upgrade --user "$@"
 pip3 install pandas --upgrade --user "$@"
 pip3 install python-dotenv --upgrade --user "$@"
@@ -2,15 +2,32 @@
 Initialization file for the utilities package.
 """
 
+from .adaptive_limiter import AdaptiveLimiter
+from .azure_openai_batches import AzureOpenAIBatches
 from .azure_openai_chat_completions import AzureOpenAIChatCompletions
+from .azure_openai_client_pool import AzureOpenAIClientPool
 from .azure_openai_embeddings import AzureOpenAIEmbeddings
 from .azure_openai_models import AzureOpenAIModels
+from .azure_search_cache import AzureSearchCache
 from .azure_search_index import AzureSearchIndex
 from .azure_search_indexes import AzureSearchIndexes
 from .azure_search_semantic_configs import AzureSearchSemanticConfigs
+from .azure_search_vector_modes import AzureSearchVectorModes
 from .chat_entries import ChatEntries
 from .console_colors import ConsoleColors
 from .env_variables import EnvVariables
+from .jira_api import JiraApi
+from .jira_ticket_enricher import JiraTicketEnricher
+from .latency_policy import LatencyPolicy
+from .load_balancing_strategies import LoadBalancingStrategies
 from .logger import Logger
 from .metadata_files import MetadataFiles
+from .output_formats import OutputFormats
+from .output_sink import OutputSink
+from .prompt_registry import PromptRegistry
+from .run_metrics import RunMetrics
+from .run_stages import RunStages
+from .run_store import RunStore
+from .semantic_cache import SemanticCache
 from .system_messages import SystemMessages
+from .token_chunker import TokenChunker
@@ -0,0 +1,149 @@
+import statistics
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Final, Iterator, final
+
+from azure.core.exceptions import ServiceResponseTimeoutError
+from openai import APITimeoutError
+
+from util.run_metrics import RunMetrics
+
+
+@final
+class _Limit:
+    """
+    The concurrency limit and recent latencies of one deployment or service.
+    """
+
+    def __init__(self, limit: float, window: int) -> None:
+        """
+        Initializes the limit.
+        :param limit: The initial concurrency limit.
+        :param window: The number of recent latencies to keep.
+        """
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self.latencies: deque[float] = deque(maxlen=window)
+        self.limit = limit
+
+
+@final
+class AdaptiveLimiter:
+    """
+    AIMD (additive-increase/multiplicative-decrease) concurrency limiter for outbound calls, with a separate limit for
+    each deployment or service. The limit grows by one for each limit's worth of calls that succeed, and is halved when
+    a call is throttled, times out or, if its latency is used, is much slower than the median of the recent calls. A
+    limit only caps the concurrent calls; calls made one at a time (e.g. the chat calls of a single ticket) never reach
+    it.
+    """
+    _DECREASE_FACTOR: Final[float] = 0.5
+    _INITIAL_LIMIT: Final[float] = 4.0
+    _LATENCY_SPIKE: Final[float] = 2.5  # The multiple of the median latency that counts as a spike.
+    _LATENCY_WINDOW: Final[int] = 50  # The number of recent latencies the median is taken from.
+    _MAX_LIMIT: Final[float] = 64.0
+    _MIN_LIMIT: Final[float] = 1.0
+    _MIN_SAMPLES: Final[int] = 10  # The number of latencies needed before a slow call counts as a spike.
+    _limits: dict[str, _Limit] = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _get_limit(key: str) -> _Limit:
+        """
+        Returns the limit for a key, creating it if it does not exist.
+        :param key: The deployment or service key.
+        :return: The limit.
+        """
+        with AdaptiveLimiter._lock:
+            if key not in AdaptiveLimiter._limits:
+                AdaptiveLimiter._limits[key] = _Limit(AdaptiveLimiter._INITIAL_LIMIT, AdaptiveLimiter._LATENCY_WINDOW)
+                RunMetrics.set(f"limit.{key}", AdaptiveLimiter._INITIAL_LIMIT)
+
+            return AdaptiveLimiter._limits[key]
+
+    @staticmethod
+    def _is_overloaded(exception: BaseException) -> bool:
+        """
+        Returns whether a failed call indicates the deployment or service is overloaded.
+        :param exception: The exception raised by the call.
+        :return: True if the call was throttled or timed out.
+        """
+        if getattr(exception, "status_code", None) == 429:
+            return True
+
+        return isinstance(exception, (APITimeoutError, ServiceResponseTimeoutError, TimeoutError))
+
+    @staticmethod
+    def _update(key: str, limit: _Limit, latency: float, *, overloaded: bool, use_latency: bool) -> None:
+        """
+        Updates the limit after a call. Must be called while holding the limit's condition.
+        :param key: The deployment or service key.
+        :param limit: The limit.
+        :param latency: The latency of the call in seconds.
+        :param overloaded: Whether the call was throttled or timed out.
+        :param use_latency: Whether a latency spike counts as overload.
+        :return: None
+        """
+        median = statistics.median(limit.latencies) if limit.latencies else latency
+        spike = (use_latency and len(limit.latencies) >= AdaptiveLimiter._MIN_SAMPLES
+                 and latency > median * AdaptiveLimiter._LATENCY_SPIKE)
+
+        if overloaded or spike:
+            # Decrease at most once per median latency, so a burst of failures from the same overload counts once.
+            now = time.monotonic()
+
+            if now - limit.last_decrease >= median:
+                limit.last_decrease = now
+                limit.limit = max(limit.limit * AdaptiveLimiter._DECREASE_FACTOR, AdaptiveLimiter._MIN_LIMIT)
+                RunMetrics.add(f"limit_decreases.{key}")
+        else:
+            limit.limit = min(limit.limit + 1 / limit.limit, AdaptiveLimiter._MAX_LIMIT)
+
+        # A timed out call has no real latency, but a slow call that completed still moves the median.
+        if not overloaded:
+            limit.latencies.append(latency)
+
+        RunMetrics.set(f"limit.{key}", round(limit.limit, 2))
+
+    @staticmethod
+    @contextmanager
+    def acquire(key: str, *, use_latency: bool = True) -> Iterator[None]:
+        """
+        Waits until a call for the key is within its concurrency limit, then updates the limit from the call's latency
+        and outcome when it completes. Example: with AdaptiveLimiter.acquire("search:index"): ...
+        :param key: The deployment or service key (e.g. "chat:gpt-4").
+        :param use_latency: Whether a latency spike counts as overload. Set to false for calls whose latency depends on
+        the size of the response (e.g. chat completions), so only throttles and timeouts decrease the limit. The default
+        value is true.
+        :return: A context manager for the call.
+        """
+        limit = AdaptiveLimiter._get_limit(key)
+
+        with limit.condition:
+            while limit.in_flight >= int(limit.limit):
+                limit.condition.wait()
+
+            limit.in_flight += 1
+
+        failed = False
+        overloaded = False
+        start = time.perf_counter()
+
+        try:
+            yield
+        except BaseException as exception:
+            failed = True
+            overloaded = AdaptiveLimiter._is_overloaded(exception)
+            raise
+        finally:
+            with limit.condition:
+                limit.in_flight -= 1
+
+                # Other failures say nothing about the load, so they leave the limit as is.
+                if overloaded or not failed:
+                    AdaptiveLimiter._update(key, limit, time.perf_counter() - start, overloaded=overloaded,
+                                            use_latency=use_latency)
+
+                limit.condition.notify_all()
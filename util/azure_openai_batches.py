@@ -0,0 +1,273 @@
+import json
+import os
+import time
+from typing import Any, Callable, Final, final
+
+from openai.lib.azure import AzureOpenAI
+from openai.types import Batch
+
+from definitions import ChatHistory
+
+
+@final
+class AzureOpenAIBatches:
+    """
+    Utility class for the Azure OpenAI Batch API JSONL workflow.
+    """
+    _ENDPOINT: Final[str] = "/chat/completions"
+    _TERMINAL_STATUSES: Final[tuple[str, ...]] = ("cancelled", "completed", "expired", "failed")
+
+    @staticmethod
+    def _write_atomically(file_name: str, content: str | bytes) -> None:
+        """
+        Writes the content to a temporary file and moves it into place so a partially written file is never read.
+        :param file_name: The file path.
+        :param content: The content.
+        :return: None
+        """
+        temp_file_name = f"{file_name}.tmp"
+
+        with open(temp_file_name, mode="wb") as file:
+            file.write(content.encode("utf-8") if isinstance(content, str) else content)
+
+        os.replace(temp_file_name, file_name)
+
+    @staticmethod
+    def create_request(custom_id: str, *, model: str, chat_history: ChatHistory, temperature: float = 1,
+                       top_p: float = 1) -> dict[str, Any]:
+        """
+        Returns a chat completions request in the Batch API format.
+        :param custom_id: The id used to match the result to the request.
+        :param model: The model (global batch deployment) to use.
+        :param chat_history: The chat history.
+        :param temperature: The sampling temperature. The default value is 1.
+        :param top_p: The nucleus sampling. The default value is 1.
+        :return: The request.
+        """
+        return {"custom_id": custom_id, "method": "POST", "url": AzureOpenAIBatches._ENDPOINT,
+                "body": {"model": model, "messages": chat_history, "temperature": temperature, "top_p": top_p}}
+
+    @staticmethod
+    def _get_error_message(result: dict[str, Any]) -> str:
+        """
+        Returns the error message of a failed batch request.
+        :param result: The batch output or error line.
+        :return: The error message.
+        """
+        response = result.get("response") or {}
+        error = result.get("error") or (response.get("body") or {}).get("error") or {}
+
+        return error.get("message", str(error)) if isinstance(error, dict) else str(error)
+
+    @staticmethod
+    def _run_round(client: AzureOpenAI, *, file_prefix: str, poll_interval: float) -> tuple[dict[str, str], bool]:
+        """
+        Runs one round of a batch phase: submits the round's requests unless an earlier run already did, waits for the
+        batch and downloads its results and errors. If the batch does not complete, its batch id file is removed so the
+        requests are submitted again by the next run.
+        :param client: The Azure OpenAI client.
+        :param file_prefix: The file path prefix for the round files.
+        :param poll_interval: The number of seconds between polls of the batch status.
+        :return: A dictionary of the response content by custom id, and whether the round was run rather than read
+        from the results of an earlier run.
+        """
+        from util import Logger  # Avoid circular import.
+
+        batch_file_name = f"{file_prefix}-batch.json"
+        requests_file_name = f"{file_prefix}-requests.jsonl"
+        results_file_name = f"{file_prefix}-results.jsonl"
+
+        if os.path.exists(results_file_name):
+            Logger.info("Resuming from batch results '%s'.", results_file_name)
+            return AzureOpenAIBatches.read_results(results_file_name), False
+
+        # Submit the batch unless an earlier run already did.
+        if os.path.exists(batch_file_name):
+            with open(batch_file_name, encoding="utf-8", mode="r") as file:
+                batch_id = json.load(file)["batch_id"]
+
+            Logger.info("Resuming batch %s.", batch_id)
+        else:
+            batch_id = AzureOpenAIBatches.submit(client, file_name=requests_file_name)
+            AzureOpenAIBatches._write_atomically(batch_file_name, json.dumps({"batch_id": batch_id}))
+            Logger.info("Submitted batch %s for '%s'.", batch_id, requests_file_name)
+
+        batch = AzureOpenAIBatches.wait(client, batch_id=batch_id, poll_interval=poll_interval)
+
+        if batch.status != "completed":
+            os.remove(batch_file_name)
+            Logger.error("error: Batch %s finished with status '%s'; its requests will be submitted again on the next "
+                         "run.", batch_id, batch.status)
+            return {}, True
+
+        AzureOpenAIBatches.download_results(client, batch=batch, file_name=results_file_name,
+                                            error_file_name=f"{file_prefix}-errors.jsonl")
+
+        return AzureOpenAIBatches.read_results(results_file_name), True
+
+    @staticmethod
+    def download_results(client: AzureOpenAI, *, batch: Batch, file_name: str, error_file_name: str) -> None:
+        """
+        Downloads the output and error files of a completed batch, logging the failed requests in the error file.
+        :param client: The Azure OpenAI client.
+        :param batch: The batch.
+        :param file_name: The file path to save the results to.
+        :param error_file_name: The file path to save the errors to.
+        :return: None
+        :raises RuntimeError: If the batch did not complete.
+        """
+        from util import Logger  # Avoid circular import.
+
+        if batch.status != "completed":
+            raise RuntimeError(f"Batch {batch.id} finished with status '{batch.status}'.")
+
+        # Write the errors first, so they are kept if the run stops before the results are written.
+        if batch.error_file_id:
+            errors = client.files.content(batch.error_file_id).read()
+            AzureOpenAIBatches._write_atomically(error_file_name, errors)
+
+            for line in errors.decode("utf-8").splitlines():
+                if line.strip():
+                    error = json.loads(line)
+                    Logger.error("error: Batch request '%s' failed: %s", error.get("custom_id"),
+                                 AzureOpenAIBatches._get_error_message(error))
+
+        content = client.files.content(batch.output_file_id).read() if batch.output_file_id else b""
+
+        AzureOpenAIBatches._write_atomically(file_name, content)
+
+    @staticmethod
+    def read_results(file_name: str) -> dict[str, str]:
+        """
+        Reads the results of a batch.
+        :param file_name: The file path of the batch output.
+        :return: A dictionary of the response content by custom id. Failed requests are omitted.
+        """
+        from util import Logger  # Avoid circular import.
+
+        results = {}
+
+        with open(file_name, encoding="utf-8", mode="r") as file:
+            for line in file:
+                if not line.strip():
+                    continue
+
+                result = json.loads(line)
+                response = result.get("response") or {}
+
+                if response.get("status_code") != 200:
+                    Logger.warning("Batch request '%s' failed: %s", result["custom_id"],
+                                   AzureOpenAIBatches._get_error_message(result))
+                    continue
+
+                results[result["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+
+        return results
+
+    @staticmethod
+    def read_custom_ids(file_name: str) -> list[str]:
+        """
+        Reads the custom ids of the batch requests.
+        :param file_name: The file path of the batch requests.
+        :return: The custom ids.
+        """
+        with open(file_name, encoding="utf-8", mode="r") as file:
+            return [json.loads(line)["custom_id"] for line in file if line.strip()]
+
+    @staticmethod
+    def run(client: AzureOpenAI, *, custom_ids: list[str], create_request: Callable[[str], dict[str, Any]],
+            file_prefix: str, poll_interval: float = 60) -> dict[str, str]:
+        """
+        Runs a batch phase in rounds, resuming from the files of earlier runs. Round n is kept in
+        <prefix>-<n>-requests.jsonl, the batch requests; <prefix>-<n>-batch.json, the submitted batch id; and
+        <prefix>-<n>-results.jsonl and <prefix>-<n>-errors.jsonl, the batch output and failed requests. The requests of
+        a batch that did not complete are submitted again, and the custom ids without a result, e.g. tickets added
+        since the last run or requests that failed, are submitted in a new round. Each custom id is submitted at most
+        once per run.
+        :param client: The Azure OpenAI client.
+        :param custom_ids: The custom ids of the requests.
+        :param create_request: A callable returning the batch request for a custom id.
+        :param file_prefix: The file path prefix for the phase files.
+        :param poll_interval: The number of seconds between polls of the batch status. The default value is 60.
+        :return: A dictionary of the response content by custom id.
+        """
+        from util import Logger  # Avoid circular import.
+
+        results = {}
+        submitted = set()
+        round_number = 1
+
+        while True:
+            round_prefix = f"{file_prefix}-{round_number}"
+            requests_file_name = f"{round_prefix}-requests.jsonl"
+
+            # Start a new round for the custom ids without a result.
+            if not os.path.exists(requests_file_name):
+                missing = [custom_id for custom_id in custom_ids if custom_id not in results and
+                           custom_id not in submitted]
+
+                if not missing:
+                    break
+
+                Logger.info("Creating batch round %s for %s requests.", round_number, len(missing))
+                AzureOpenAIBatches.write_requests(requests_file_name, [create_request(custom_id)
+                                                                       for custom_id in missing])
+
+            round_results, ran = AzureOpenAIBatches._run_round(client, file_prefix=round_prefix,
+                                                               poll_interval=poll_interval)
+            results.update(round_results)
+
+            if ran:
+                submitted.update(AzureOpenAIBatches.read_custom_ids(requests_file_name))
+
+            round_number += 1
+
+        return {custom_id: results[custom_id] for custom_id in custom_ids if custom_id in results}
+
+    @staticmethod
+    def submit(client: AzureOpenAI, *, file_name: str) -> str:
+        """
+        Uploads the requests file and creates a batch for it.
+        :param client: The Azure OpenAI client.
+        :param file_name: The file path of the batch requests.
+        :return: The batch id.
+        """
+        with open(file_name, mode="rb") as file:
+            input_file = client.files.create(file=file, purpose="batch")
+
+        batch = client.batches.create(input_file_id=input_file.id, endpoint=AzureOpenAIBatches._ENDPOINT,
+                                      completion_window="24h")
+
+        return batch.id
+
+    @staticmethod
+    def wait(client: AzureOpenAI, *, batch_id: str, poll_interval: float = 60) -> Batch:
+        """
+        Polls the batch until it reaches a terminal status.
+        :param client: The Azure OpenAI client.
+        :param batch_id: The batch id.
+        :param poll_interval: The number of seconds between polls. The default value is 60.
+        :return: The batch.
+        """
+        from util import Logger  # Avoid circular import.
+
+        while True:
+            batch = client.batches.retrieve(batch_id)
+
+            if batch.status in AzureOpenAIBatches._TERMINAL_STATUSES:
+                return batch
+
+            counts = batch.request_counts
+            progress = f" ({counts.completed + counts.failed}/{counts.total})" if counts else ""
+            Logger.info("Batch %s is %s%s; checking again in %gs...", batch_id, batch.status, progress, poll_interval)
+            time.sleep(poll_interval)
+
+    @staticmethod
+    def write_requests(file_name: str, requests: list[dict[str, Any]]) -> None:
+        """
+        Writes the batch requests as JSONL.
+        :param file_name: The file path.
+        :param requests: The batch requests.
+        :return: None
+        """
+        AzureOpenAIBatches._write_atomically(file_name, "".join(f"{json.dumps(request)}\n" for request in requests))
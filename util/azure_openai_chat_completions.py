@@ -1,10 +1,15 @@
 import json
 from typing import final, Callable
 
+from openai import NOT_GIVEN
 from openai.lib.azure import AzureOpenAI
-from openai.types.chat import ChatCompletionMessage
+from openai.types.chat import ChatCompletion, ChatCompletionMessage
 
 from definitions import ChatHistory, ChatTool
+from util.adaptive_limiter import AdaptiveLimiter
+from util.azure_openai_client_pool import AzureOpenAIClientPool
+from util.latency_policy import LatencyPolicy
+from util.run_metrics import RunMetrics
 
 
 @final
@@ -14,11 +19,37 @@ class AzureOpenAIChatCompletions:
     """
 
     @staticmethod
-    def append_tool_responses(client: AzureOpenAI, *, model: str, chat_history: ChatHistory, tools: list[ChatTool],
-                              function_names: list[str], functions: list[Callable]) -> ChatHistory:
+    def _record_usage(model: str, response: ChatCompletion) -> None:
+        """
+        Adds the token usage of a response, including the prompt tokens served from the prompt cache, to the run
+        metrics.
+        :param model: The model used.
+        :param response: The chat completion.
+        :return: None
+        """
+        from util import Logger  # Avoid circular import.
+
+        usage = response.usage
+
+        if not usage:
+            return
+
+        details = usage.prompt_tokens_details
+        cached_tokens = details.cached_tokens if details and details.cached_tokens else 0
+
+        RunMetrics.add(f"chat.{model}.cached_tokens", cached_tokens)
+        RunMetrics.add(f"chat.{model}.completion_tokens", usage.completion_tokens)
+        RunMetrics.add(f"chat.{model}.prompt_tokens", usage.prompt_tokens)
+        Logger.debug("Model '%s' used %s prompt tokens (%s cached) and %s completion tokens.", model,
+                     usage.prompt_tokens, cached_tokens, usage.completion_tokens)
+
+    @staticmethod
+    def append_tool_responses(client: AzureOpenAI | AzureOpenAIClientPool, *, model: str, chat_history: ChatHistory,
+                              tools: list[ChatTool], function_names: list[str],
+                              functions: list[Callable]) -> ChatHistory:
         """
         Appends the responses from calling the tools to the chat history.
-        :param client: The Azure OpenAI client.
+        :param client: The Azure OpenAI client or client pool.
         :param model: The model to use.
         :param chat_history: The chat history.
         :param tools: The chat completion tools.
@@ -28,7 +59,10 @@ class AzureOpenAIChatCompletions:
         """
         from util import ChatEntries  # Avoid circular import.
 
-        response = client.chat.completions.create(model=model, messages=chat_history, tools=tools, tool_choice="auto")
+        with AdaptiveLimiter.acquire(f"chat:{model}", use_latency=False):
+            response = client.chat.completions.create(model=model, messages=chat_history, tools=tools,
+                                                      tool_choice="auto")
+
         tools = response.choices[0].message
 
         # Map function names to actual functions.
@@ -48,18 +82,46 @@ class AzureOpenAIChatCompletions:
         return chat_history
 
     @staticmethod
-    def run_conversation(client: AzureOpenAI, *, model: str, chat_history: ChatHistory, temperature: float = 1,
-                         top_p: float = 1) -> ChatCompletionMessage:
+    def run_conversation(client: AzureOpenAI | AzureOpenAIClientPool, *, model: str, chat_history: ChatHistory,
+                         temperature: float = 1, top_p: float = 1,
+                         timeout: float | None = None) -> ChatCompletionMessage:
         """
         Runs a conversation with the chat completions AI and returns the response.
-        :param client: The Azure OpenAI client.
+        :param client: The Azure OpenAI client or client pool.
         :param model: The model to use.
         :param chat_history: The chat history.
         :param temperature: The sampling temperature. The default value is 1.
         :param top_p: The nucleus sampling. The default value is 1.
+        :param timeout: The request timeout in seconds. The default value is the client timeout.
         :return: The AI response.
         """
-        response = client.chat.completions.create(model=model, messages=chat_history, temperature=temperature,
-                                                  top_p=top_p)
+        # The latency depends on the completion length, so only throttles and timeouts decrease the limit.
+        with AdaptiveLimiter.acquire(f"chat:{model}", use_latency=False):
+            response = client.chat.completions.create(model=model, messages=chat_history, temperature=temperature,
+                                                      top_p=top_p, timeout=timeout if timeout else NOT_GIVEN)
+
+        AzureOpenAIChatCompletions._record_usage(model, response)
 
         return response.choices[0].message
+
+    @staticmethod
+    def run_conversation_with_policy(client: AzureOpenAI | AzureOpenAIClientPool, *, policy: LatencyPolicy,
+                                     chat_history: ChatHistory, temperature: float = 1,
+                                     top_p: float = 1) -> ChatCompletionMessage:
+        """
+        Runs a conversation with the chat completions AI, hedging and falling back across the models of the latency
+        policy, and returns the first response. With more than one model, the client does not retry the requests itself,
+        so a request falls back to the next model after the policy timeout rather than after the client's retries.
+        :param client: The Azure OpenAI client or client pool.
+        :param policy: The latency policy.
+        :param chat_history: The chat history.
+        :param temperature: The sampling temperature. The default value is 1.
+        :param top_p: The nucleus sampling. The default value is 1.
+        :return: The AI response.
+        """
+        # Without a model to fall back to, keep the client's retries with backoff for throttling and transient errors.
+        if isinstance(client, AzureOpenAI) and len(policy.models) > 1:
+            client = client.with_options(max_retries=0)
+
+        return policy.run(lambda model, timeout: AzureOpenAIChatCompletions.run_conversation(
+            client, model=model, chat_history=chat_history, temperature=temperature, top_p=top_p, timeout=timeout))
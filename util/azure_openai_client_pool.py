@@ -0,0 +1,330 @@
+import json
+import threading
+import time
+from typing import Any, Final, final
+
+from openai import APIConnectionError, APIStatusError, APITimeoutError
+from openai.lib.azure import AzureOpenAI
+
+from util.load_balancing_strategies import LoadBalancingStrategies
+
+
+@final
+class _PooledEndpoint:
+    """
+    An Azure OpenAI resource in the client pool along with its health and statistics.
+    """
+
+    def __init__(self, *, client: AzureOpenAI, endpoint: str, weight: int, deployments: dict[str, str]) -> None:
+        """
+        Initializes the pooled endpoint.
+        :param client: The Azure OpenAI client for the endpoint.
+        :param endpoint: The endpoint.
+        :param weight: The weight for the weighted round-robin strategy.
+        :param deployments: Map of model names to the deployment names on the endpoint. If empty, every model is
+        deployed under its own name.
+        """
+        self.client = client
+        self.consecutive_failures = 0
+        self.current_weight = 0
+        self.deployments = deployments
+        self.ejected_until = 0.0
+        self.endpoint = endpoint
+        self.outstanding = 0
+        self.weight = weight
+
+        # Statistics.
+        self.ejections = 0
+        self.errors = 0
+        self.requests = 0
+        self.successes = 0
+        self.throttles = 0
+        self.total_latency = 0.0
+
+    def get_deployment(self, model: str) -> str | None:
+        """
+        Returns the deployment name for the model.
+        :param model: The model.
+        :return: The deployment name, or None if the model is not deployed on the endpoint.
+        """
+        if not self.deployments:
+            return model
+
+        return self.deployments.get(model)
+
+    def get_stats(self) -> dict[str, Any]:
+        """
+        Returns the statistics for the endpoint.
+        :return: The statistics.
+        """
+        return {"endpoint": self.endpoint, "requests": self.requests, "successes": self.successes,
+                "throttles": self.throttles, "errors": self.errors, "ejections": self.ejections,
+                "outstanding": self.outstanding,
+                "mean_latency": self.total_latency / self.successes if self.successes else 0.0}
+
+
+@final
+class _PooledResource:
+    """
+    A pooled API resource exposing the same create method as the Azure OpenAI client resources.
+    """
+
+    def __init__(self, pool: "AzureOpenAIClientPool", path: tuple[str, ...]) -> None:
+        """
+        Initializes the pooled resource.
+        :param pool: The client pool.
+        :param path: The attribute path to the resource on the client (e.g. ("chat", "completions")).
+        """
+        self._path = path
+        self._pool = pool
+
+    def create(self, **kwargs: Any) -> Any:
+        """
+        Calls the create method of the resource on an endpoint chosen by the pool.
+        :param kwargs: The arguments for the create method.
+        :return: The API response.
+        """
+        return self._pool._create(self._path, **kwargs)
+
+
+@final
+class _PooledChat:
+    """
+    The pooled chat resource.
+    """
+
+    def __init__(self, pool: "AzureOpenAIClientPool") -> None:
+        """
+        Initializes the pooled chat resource.
+        :param pool: The client pool.
+        """
+        self.completions = _PooledResource(pool, ("chat", "completions"))
+
+
+@final
+class AzureOpenAIClientPool:
+    """
+    Pool of Azure OpenAI clients for spreading requests across several resources. The pool exposes the same
+    chat.completions and embeddings interface as the Azure OpenAI client.
+    """
+    _BASE_EJECTION_TIME: Final[float] = 5.0
+    _MAX_ATTEMPTS: Final[int] = 3  # The number of times a request may be sent to each endpoint.
+    _MAX_EJECTION_TIME: Final[float] = 300.0
+
+    def __init__(self, endpoints: list[_PooledEndpoint], *,
+                 strategy: LoadBalancingStrategies = LoadBalancingStrategies.ROUND_ROBIN) -> None:
+        """
+        Initializes the client pool.
+        :param endpoints: The pooled endpoints.
+        :param strategy: The load balancing strategy. The default value is weighted round-robin.
+        :raises ValueError: If there are no endpoints.
+        """
+        if not endpoints:
+            raise ValueError("The client pool requires at least one endpoint.")
+
+        self.chat = _PooledChat(self)
+        self.embeddings = _PooledResource(self, ("embeddings",))
+        self.strategy = strategy
+        self._endpoints = endpoints
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _get_ejection_time(endpoint: _PooledEndpoint, exception: BaseException) -> float:
+        """
+        Returns the number of seconds to eject the endpoint for, honoring the Retry-After header if present.
+        :param endpoint: The endpoint.
+        :param exception: The exception raised by the request.
+        :return: The number of seconds.
+        """
+        if isinstance(exception, APIStatusError):
+            retry_after = exception.response.headers.get("retry-after")
+
+            if retry_after and retry_after.isdigit():
+                return min(float(retry_after), AzureOpenAIClientPool._MAX_EJECTION_TIME)
+
+        backoff = AzureOpenAIClientPool._BASE_EJECTION_TIME * (2 ** (endpoint.consecutive_failures - 1))
+
+        return min(backoff, AzureOpenAIClientPool._MAX_EJECTION_TIME)
+
+    @staticmethod
+    def _is_ejectable(exception: BaseException) -> bool:
+        """
+        Returns whether a failed request should eject the endpoint and be retried on another endpoint.
+        :param exception: The exception raised by the request.
+        :return: True if the endpoint was throttled, returned a 5xx status code or could not be reached.
+        """
+        if isinstance(exception, APIStatusError):
+            return exception.status_code == 429 or exception.status_code >= 500
+
+        # Timeouts are left to the caller's latency policy rather than retried on every endpoint.
+        return isinstance(exception, APIConnectionError) and not isinstance(exception, APITimeoutError)
+
+    @staticmethod
+    def from_file(file_name: str, *, api_version: str) -> "AzureOpenAIClientPool":
+        """
+        Creates a client pool from a JSON configuration file. Example:
+        {"strategy": "least-outstanding", "endpoints": [{"endpoint": "https://...", "api_key": "...", "weight": 2,
+        "deployments": {"GPT-4": "gpt-4-eastus"}}]}
+        :param file_name: The file path.
+        :param api_version: The Azure OpenAI API version.
+        :return: The client pool.
+        :raises ValueError: If the configuration is invalid.
+        """
+        with open(file_name, encoding="utf-8", mode="r") as file:
+            config = json.load(file)
+
+        endpoints = []
+
+        for entry in config.get("endpoints", []):
+            try:
+                # The pool retries on another endpoint itself, so the client must not retry the same one.
+                client = AzureOpenAI(azure_endpoint=entry["endpoint"], api_key=entry["api_key"],
+                                     api_version=api_version, max_retries=0)
+                endpoints.append(_PooledEndpoint(client=client, endpoint=entry["endpoint"],
+                                                 weight=max(int(entry.get("weight", 1)), 1),
+                                                 deployments=entry.get("deployments", {})))
+            except KeyError as error:
+                raise ValueError(f"Client pool endpoint is missing {error} in '{file_name}'.")
+
+        strategy = LoadBalancingStrategies(config.get("strategy", LoadBalancingStrategies.ROUND_ROBIN))
+
+        return AzureOpenAIClientPool(endpoints, strategy=strategy)
+
+    def _acquire(self, model: str, tried: set[int]) -> _PooledEndpoint | None:
+        """
+        Chooses an endpoint for the model and marks a request as outstanding on it.
+        :param model: The model.
+        :param tried: The indexes of the endpoints that already failed for this request.
+        :return: The endpoint, or None if there are no endpoints left to try.
+        """
+        with self._lock:
+            now = time.monotonic()
+            candidates = [endpoint for index, endpoint in enumerate(self._endpoints)
+                          if index not in tried and endpoint.get_deployment(model)]
+
+            if not candidates:
+                return None
+
+            healthy = [endpoint for endpoint in candidates if endpoint.ejected_until <= now]
+
+            if not healthy:
+                # Every endpoint is ejected; use the one that will recover first, which the caller waits for.
+                endpoint = min(candidates, key=lambda candidate: candidate.ejected_until)
+            elif self.strategy == LoadBalancingStrategies.LEAST_OUTSTANDING:
+                endpoint = min(healthy, key=lambda candidate: candidate.outstanding / candidate.weight)
+            else:
+                # Smooth weighted round-robin.
+                total_weight = 0
+
+                for candidate in healthy:
+                    candidate.current_weight += candidate.weight
+                    total_weight += candidate.weight
+
+                endpoint = max(healthy, key=lambda candidate: candidate.current_weight)
+                endpoint.current_weight -= total_weight
+
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+
+            return endpoint
+
+    def _create(self, path: tuple[str, ...], **kwargs: Any) -> Any:
+        """
+        Calls the create method of the resource, retrying on the other endpoints if an endpoint is throttled or
+        unhealthy. Once every endpoint has failed, the request is retried after the first endpoint recovers, up to the
+        maximum number of attempts.
+        :param path: The attribute path to the resource on the client.
+        :param kwargs: The arguments for the create method.
+        :return: The API response.
+        :raises RuntimeError: If the model is not deployed on any endpoint.
+        """
+        from util import Logger  # Avoid circular import.
+
+        model = kwargs["model"]
+        attempt = 1
+        last_exception = None
+        tried = set()
+
+        while True:
+            endpoint = self._acquire(model, tried)
+
+            if endpoint is None:
+                if last_exception is None:
+                    raise RuntimeError(f"Model '{model}' is not deployed on any endpoint in the client pool.")
+
+                if attempt >= AzureOpenAIClientPool._MAX_ATTEMPTS:
+                    raise last_exception
+
+                # Try every endpoint again, starting with the one that recovers first.
+                attempt += 1
+                tried.clear()
+                continue
+
+            # Wait for an ejected endpoint to recover, honoring its Retry-After header.
+            delay = endpoint.ejected_until - time.monotonic()
+
+            if delay > 0:
+                Logger.warning("Every endpoint for model '%s' is ejected; retrying on '%s' in %.1fs...", model,
+                               endpoint.endpoint, delay)
+                time.sleep(delay)
+
+            resource = endpoint.client
+
+            for name in path:
+                resource = getattr(resource, name)
+
+            start = time.perf_counter()
+
+            try:
+                response = resource.create(**{**kwargs, "model": endpoint.get_deployment(model)})
+            except Exception as exception:
+                self._release(endpoint, exception=exception)
+
+                if not AzureOpenAIClientPool._is_ejectable(exception):
+                    raise
+
+                Logger.warning("Endpoint '%s' failed (%s); ejecting it temporarily.", endpoint.endpoint, exception)
+                last_exception = exception
+                tried.add(self._endpoints.index(endpoint))
+                continue
+
+            self._release(endpoint, latency=time.perf_counter() - start)
+
+            return response
+
+    def _release(self, endpoint: _PooledEndpoint, *, exception: BaseException | None = None,
+                 latency: float = 0.0) -> None:
+        """
+        Marks a request as complete on the endpoint and updates its health and statistics.
+        :param endpoint: The endpoint.
+        :param exception: The exception raised by the request, if any.
+        :param latency: The latency of a successful request in seconds.
+        :return: None
+        """
+        with self._lock:
+            endpoint.outstanding -= 1
+
+            if exception is None:
+                endpoint.consecutive_failures = 0
+                endpoint.successes += 1
+                endpoint.total_latency += latency
+            elif AzureOpenAIClientPool._is_ejectable(exception):
+                if isinstance(exception, APIStatusError) and exception.status_code == 429:
+                    endpoint.throttles += 1
+                else:
+                    endpoint.errors += 1
+
+                endpoint.consecutive_failures += 1
+                endpoint.ejected_until = time.monotonic() + AzureOpenAIClientPool._get_ejection_time(endpoint,
+                                                                                                     exception)
+                endpoint.ejections += 1
+            else:
+                endpoint.errors += 1
+
+    def get_stats(self) -> list[dict[str, Any]]:
+        """
+        Returns the statistics for each endpoint in the pool.
+        :return: The statistics.
+        """
+        with self._lock:
+            return [endpoint.get_stats() for endpoint in self._endpoints]
@@ -1,11 +1,13 @@
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Final, final
 
-import tiktoken
 from openai.lib.azure import AzureOpenAI
-from tiktoken import Encoding
 
 from definitions import Embeddings
+from util.adaptive_limiter import AdaptiveLimiter
+from util.azure_openai_client_pool import AzureOpenAIClientPool
+from util.token_chunker import TokenChunker
 
 
 @final
@@ -13,72 +15,59 @@ class AzureOpenAIEmbeddings:
     """
     Utility class for the Azure OpenAI framework.
     """
-    _MAX_TOKENS: Final[int] = 8192
-    _TOKENIZER: Final[Encoding] = tiktoken.get_encoding("cl100k_base")
+    _MAX_TOKENS: Final[int] = 8191  # The input limit of the embedding models.
+    _MAX_WORKERS: Final[int] = 8
 
     @staticmethod
-    def _split_text_into_chunks(text: str, max_tokens: int = _MAX_TOKENS) -> list[str]:
+    def _generate_for_chunk(client: AzureOpenAI | AzureOpenAIClientPool, *, model: str, chunk: list[int],
+                            max_retries: int) -> Embeddings:
         """
-        Splits the text into chunks that have a maximum number of tokens specified by max_tokens.
-        :param text: The text to split.
-        :param max_tokens: The maximum number of tokens in each chunk. The default value is 8192.
-        :return: A list of text chunks.
-        :raises RuntimeError: If an error occurs during tokenization.
-        :raises ValueError: If the input text is empty or not a string.
+        Generate embeddings for a chunk of text, retrying with an exponential backoff.
+        :param client: The Azure OpenAI client or client pool.
+        :param model: The model to use.
+        :param chunk: The chunk of text as tokens, which are sent as is rather than decoded back into text.
+        :param max_retries: The maximum number of retries in case of a failed attempt.
+        :return: The embeddings for the chunk.
+        :raises RuntimeError: If the maximum number of retries is reached while generating embeddings.
         """
-        chunks = []
-
-        if not isinstance(text, str) or not text:
-            raise ValueError("Input text must be a non-empty string.")
-
-        try:
-            start = 0
-            tokens = AzureOpenAIEmbeddings._TOKENIZER.encode(text)
-
-            while start < len(tokens):
-                # Constrain the index.
-                end = min(start + max_tokens, len(tokens))
-
-                # Decode the tokens back into string text to form a chunk.
-                chunk = AzureOpenAIEmbeddings._TOKENIZER.decode(tokens[start:end])
+        base_wait_time = 4  # Initial wait time for the exponential backoff strategy.
 
-                # Add the chunk to the list of chunks.
-                chunks.append(chunk)
+        for attempt in range(max_retries):
+            try:
+                with AdaptiveLimiter.acquire(f"embeddings:{model}"):
+                    response = client.embeddings.create(input=[chunk], model=model)
 
-                # Update the start index to the end of the last chunk to continue from there.
-                start = end
-        except Exception as exception:
-            raise RuntimeError(f"Unable to split text into chunks: {exception}")
+                return response.data[0].embedding
+            except Exception as exception:
+                if attempt == max_retries - 1:
+                    raise RuntimeError(f"Unable to generate embeddings: {exception}")
 
-        return chunks
+                wait_time = base_wait_time * (2 ** attempt)
+                time.sleep(wait_time)
 
     @staticmethod
-    def generate(client: AzureOpenAI, *, model: str, text: str, max_retries: int = 5) -> list[Embeddings]:
+    def generate(client: AzureOpenAI | AzureOpenAIClientPool, *, model: str, text: str, max_retries: int = 5,
+                 max_chunks: int | None = None, overlap: int = 0) -> list[Embeddings]:
         """
-        Generate embeddings for the text using the specified model.
-        :param client: The Azure OpenAI client.
+        Generate embeddings for the text using the specified model. The chunks of text are embedded concurrently.
+        :param client: The Azure OpenAI client or client pool.
         :param model: The model to use.
         :param text: The text to generate embeddings for.
         :param max_retries: The maximum number of retries in case of a failed attempt. The default value is 5.
+        :param max_chunks: The maximum number of chunks to embed, starting with the first. The default value is all.
+        :param overlap: The number of tokens each chunk repeats from the end of the previous chunk. The default value
+        is 0.
         :return: A list containing the embeddings for each chunk of text.
         :raises RuntimeError: If the maximum number of retries is reached while generating embeddings.
         :raises ValueError: If the input text is empty or not a string.
         """
-        base_wait_time = 4  # Initial wait time for the exponential backoff strategy.
-        chunks = AzureOpenAIEmbeddings._split_text_into_chunks(text, AzureOpenAIEmbeddings._MAX_TOKENS)
-        embeddings = []
-
-        for chunk in chunks:
-            for attempt in range(max_retries):
-                try:
-                    response = client.embeddings.create(input=[chunk], model=model)
-                    embeddings.append(response.data[0].embedding)
-                    break
-                except Exception as exception:
-                    wait_time = base_wait_time * (2 ** attempt)
-                    time.sleep(wait_time)
+        chunks = TokenChunker.chunk_text(text, max_tokens=AzureOpenAIEmbeddings._MAX_TOKENS, overlap=overlap,
+                                         max_chunks=max_chunks)
 
-                    if attempt == max_retries - 1:
-                        raise RuntimeError(f"Unable to generate embeddings: {exception}")
+        if len(chunks) == 1:
+            return [AzureOpenAIEmbeddings._generate_for_chunk(client, model=model, chunk=chunks[0],
+                                                              max_retries=max_retries)]
 
-        return embeddings
+        with ThreadPoolExecutor(max_workers=min(len(chunks), AzureOpenAIEmbeddings._MAX_WORKERS)) as executor:
+            return list(executor.map(lambda chunk: AzureOpenAIEmbeddings._generate_for_chunk(
+                client, model=model, chunk=chunk, max_retries=max_retries), chunks))
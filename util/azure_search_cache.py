@@ -0,0 +1,144 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Final, final
+
+from azure.search.documents import SearchClient
+
+from definitions import SearchIndexResults
+
+
+@final
+class AzureSearchCache:
+    """
+    SQLite LRU cache for search results. Entries are invalidated when the document count of their index changes.
+    """
+    _PROBE_INTERVAL: Final[float] = 60.0  # The seconds to trust a probed document count.
+    _SCHEMA: Final[str] = """
+        CREATE TABLE IF NOT EXISTS results (
+            key TEXT PRIMARY KEY,
+            version TEXT NOT NULL,
+            results BLOB NOT NULL,
+            last_used REAL NOT NULL
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+    """
+
+    def __init__(self, file_name: str, *, max_entries: int = 1000) -> None:
+        """
+        Opens the search cache, creating it if it does not exist.
+        :param file_name: The database file path.
+        :param max_entries: The maximum number of cached results, after which the least recently used are evicted. The
+        default value is 1000.
+        """
+        self._connection = sqlite3.connect(file_name, check_same_thread=False, isolation_level=None)
+        self._hits = 0
+        self._lock = threading.Lock()
+        self._max_entries = max_entries
+        self._misses = 0
+        self._versions = {}  # The probed version and when it was probed, by index name.
+
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(AzureSearchCache._SCHEMA)
+
+    def _get_version(self, search_client: SearchClient) -> str:
+        """
+        Returns the version of the index, probing its document count at most once per probe interval.
+        :param search_client: The search client.
+        :return: The index version.
+        """
+        index_name = AzureSearchCache.get_index_name(search_client)
+        version, probed = self._versions.get(index_name, (None, 0.0))
+
+        if version is None or time.monotonic() - probed >= AzureSearchCache._PROBE_INTERVAL:
+            version = str(search_client.get_document_count())
+            self._versions[index_name] = (version, time.monotonic())
+
+        return version
+
+    @staticmethod
+    def create_key(index_name: str, query: str, *, top_results: int, search_mode: str) -> str:
+        """
+        Returns the cache key for a search.
+        :param index_name: The index name.
+        :param query: The search query.
+        :param top_results: The number of top results.
+        :param search_mode: The search mode, including anything else that changes the results (e.g. the vector mode).
+        :return: The cache key.
+        """
+        query_hash = hashlib.sha256(query.encode("utf-8")).hexdigest()
+        key = json.dumps([index_name, query_hash, top_results, search_mode])
+
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def get_index_name(search_client: SearchClient) -> str:
+        """
+        Returns the index name of a search client.
+        :param search_client: The search client.
+        :return: The index name.
+        """
+        return search_client._index_name  # The client does not expose the index name publicly.
+
+    def close(self) -> None:
+        """
+        Closes the search cache.
+        :return: None
+        """
+        with self._lock:
+            self._connection.close()
+
+    def get(self, search_client: SearchClient, key: str) -> SearchIndexResults | None:
+        """
+        Returns the cached results for a search, removing them if the index has changed since they were cached.
+        :param search_client: The search client.
+        :param key: The cache key.
+        :return: The search results, or None if they are not cached.
+        """
+        version = self._get_version(search_client)
+
+        with self._lock:
+            row = self._connection.execute("SELECT version, results FROM results WHERE key = ?", (key,)).fetchone()
+
+            if row is None or row[0] != version:
+                if row is not None:
+                    self._connection.execute("DELETE FROM results WHERE key = ?", (key,))
+
+                self._misses += 1
+                return None
+
+            self._connection.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._hits += 1
+
+        return [tuple(result) for result in json.loads(zlib.decompress(row[1]))]
+
+    def get_stats(self) -> dict[str, int]:
+        """
+        Returns the number of cache hits and misses.
+        :return: The cache statistics.
+        """
+        return {"hits": self._hits, "misses": self._misses}
+
+    def put(self, search_client: SearchClient, key: str, results: SearchIndexResults) -> None:
+        """
+        Caches the results of a search, evicting the least recently used results if the cache is full.
+        :param search_client: The search client.
+        :param key: The cache key.
+        :param results: The search results.
+        :return: None
+        """
+        version = self._get_version(search_client)
+
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO results (key, version, results, last_used) VALUES "
+                                     "(?, ?, ?, ?)",
+                                     (key, version, zlib.compress(json.dumps(results).encode("utf-8")), time.time()))
+            excess = self._connection.execute("SELECT COUNT(*) FROM results").fetchone()[0] - self._max_entries
+
+            if excess > 0:
+                self._connection.execute("DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY "
+                                         "last_used LIMIT ?)", (excess,))
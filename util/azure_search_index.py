@@ -1,11 +1,15 @@
-from typing import final
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Final, final
 
 from azure.search.documents import SearchClient
 from azure.search.documents.models import QueryAnswerType, QueryCaptionType, QueryType, VectorizedQuery
 from openai.lib.azure import AzureOpenAI
 
 from definitions import SearchIndexResults
-from util import AzureOpenAIEmbeddings, AzureOpenAIModels
+from util import AzureOpenAIClientPool, AzureOpenAIEmbeddings, AzureOpenAIModels
+from util.adaptive_limiter import AdaptiveLimiter
+from util.azure_search_cache import AzureSearchCache
+from util.azure_search_vector_modes import AzureSearchVectorModes
 
 
 @final
@@ -13,61 +17,166 @@ class AzureSearchIndex:
     """
     Utility class for searching the index.
     """
+    _OVERFETCH: Final[int] = 2  # The multiple of the top results to search for, so deduplication keeps enough.
+    _RRF_K: Final[int] = 60  # The rank constant for reciprocal rank fusion.
 
     @staticmethod
-    def _get_vectorized_query(openai_client: AzureOpenAI, query: str) -> VectorizedQuery:
+    def _deduplicate(results: SearchIndexResults) -> SearchIndexResults:
         """
-        Generates embeddings for the query and returns it as a vectorized query.
-        :param openai_client: The Azure OpenAI client.
+        Removes the results with a helper method name that was already returned, keeping the first.
+        :param results: The search results.
+        :return: The deduplicated search results.
+        """
+        names = set()
+        unique_results = []
+
+        for result in results:
+            if result[0] not in names:
+                names.add(result[0])
+                unique_results.append(result)
+
+        return unique_results
+
+    @staticmethod
+    def _get_vectorized_queries(openai_client: AzureOpenAI | AzureOpenAIClientPool, query: str,
+                                vector_mode: AzureSearchVectorModes) -> list[VectorizedQuery]:
+        """
+        Generates embeddings for the query and returns them as vectorized queries, one per chunk of the query.
+        :param openai_client: The Azure OpenAI client or client pool.
         :param query: The search query.
-        :return: A vectorized query.
+        :param vector_mode: The vector mode. Only the first chunk is embedded for the first chunk mode.
+        :return: The vectorized queries.
         """
+        max_chunks = 1 if vector_mode == AzureSearchVectorModes.FIRST_CHUNK else None
         embeddings = AzureOpenAIEmbeddings.generate(openai_client, model=AzureOpenAIModels.TEXT_EMBEDDING_ADA_002,
-                                                    text=query)
+                                                    text=query, max_chunks=max_chunks)
+
+        return [VectorizedQuery(fields="embeddings", k_nearest_neighbors=3, vector=vector) for vector in embeddings]
+
+    @staticmethod
+    def _search(search_client: SearchClient, vector_queries: list[VectorizedQuery], *,
+                vector_mode: AzureSearchVectorModes, top_results: int, **kwargs: Any) -> SearchIndexResults:
+        """
+        Searches the index with the vectorized queries.
+        :param search_client: The search client.
+        :param vector_queries: The vectorized queries.
+        :param vector_mode: The vector mode. For reciprocal rank fusion, each vectorized query is searched separately
+        and the results are fused; otherwise, all the vectorized queries are sent in a single search.
+        :param top_results: The number of top results to return.
+        :param kwargs: The other search arguments.
+        :return: The deduplicated search results, up to the number of top results.
+        """
+        key = f"search:{AzureSearchCache.get_index_name(search_client)}"
+
+        def search(queries: list[VectorizedQuery]) -> SearchIndexResults:
+            # The results are fetched as they are iterated, so the call ends once they are read.
+            with AdaptiveLimiter.acquire(key):
+                results = search_client.search(select=("Name", "Description", "Code"),
+                                               top=top_results * AzureSearchIndex._OVERFETCH, vector_queries=queries,
+                                               **kwargs)
+
+                return [(result["Name"], result["Description"], result["Code"]) for result in results]
+
+        if vector_mode != AzureSearchVectorModes.RECIPROCAL_RANK_FUSION or len(vector_queries) == 1:
+            return AzureSearchIndex._deduplicate(search(vector_queries))[:top_results]
+
+        with ThreadPoolExecutor(max_workers=len(vector_queries)) as executor:
+            ranked_results = list(executor.map(lambda vector_query: search([vector_query]), vector_queries))
+
+        # Score each helper method by the sum of its reciprocal ranks.
+        results_by_name = {}
+        scores = {}
+
+        for results in ranked_results:
+            for rank, result in enumerate(AzureSearchIndex._deduplicate(results), start=1):
+                results_by_name.setdefault(result[0], result)
+                scores[result[0]] = scores.get(result[0], 0.0) + 1 / (AzureSearchIndex._RRF_K + rank)
+
+        names = sorted(scores, key=lambda name: scores[name], reverse=True)[:top_results]
+
+        return [results_by_name[name] for name in names]
+
+    @staticmethod
+    def _search_with_cache(cache: AzureSearchCache | None, search_client: SearchClient, *, query: str,
+                           top_results: int, search_mode: str,
+                           search: Callable[[], SearchIndexResults]) -> SearchIndexResults:
+        """
+        Returns the cached results of a search, or does the search and caches its results.
+        :param cache: The search cache, or None to always search.
+        :param search_client: The search client.
+        :param query: The search query.
+        :param top_results: The number of top results to return.
+        :param search_mode: The search mode.
+        :param search: A callable that embeds the query and searches the index.
+        :return: The search results.
+        """
+        if cache is None:
+            return search()
+
+        key = AzureSearchCache.create_key(AzureSearchCache.get_index_name(search_client), query,
+                                          top_results=top_results, search_mode=search_mode)
+        results = cache.get(search_client, key)
+
+        if results is None:
+            results = search()
+            cache.put(search_client, key, results)
 
-        return VectorizedQuery(fields="embeddings", k_nearest_neighbors=3, vector=embeddings[0])
+        return results
 
     @staticmethod
-    def do_hybrid_search(openai_client: AzureOpenAI, search_client: SearchClient, *, query: str,
-                         top_results: int = 5) -> SearchIndexResults:
+    def do_hybrid_search(openai_client: AzureOpenAI | AzureOpenAIClientPool, search_client: SearchClient, *,
+                         query: str, top_results: int = 5,
+                         vector_mode: AzureSearchVectorModes = AzureSearchVectorModes.FIRST_CHUNK,
+                         cache: AzureSearchCache | None = None) -> SearchIndexResults:
         """
         Performs a hybrid search on the index.
-        :param openai_client: The Azure OpenAI client.
+        :param openai_client: The Azure OpenAI client or client pool.
         :param search_client: The search client.
         :param query: The search query.
         :param top_results: The number of top results to return. The default value is 5.
+        :param vector_mode: How the query is vectorized. The default value is to embed only the first chunk.
+        :param cache: The search cache, which skips both the query embedding and the search on a hit. The default
+        value is none.
         :return: The search results.
         """
-        vector_query = AzureSearchIndex._get_vectorized_query(openai_client, query)
+        def search() -> SearchIndexResults:
+            vector_queries = AzureSearchIndex._get_vectorized_queries(openai_client, query, vector_mode)
 
-        # Do search.
-        results = search_client.search(search_text=query, select=("Name", "Description", "Code"), top=top_results,
-                                       vector_queries=[vector_query])
+            # Do search.
+            return AzureSearchIndex._search(search_client, vector_queries, vector_mode=vector_mode,
+                                            top_results=top_results, search_text=query)
 
-        # Return the search results.
-        return [(result["Name"], result["Description"], result["Code"]) for result in results]
+        return AzureSearchIndex._search_with_cache(cache, search_client, query=query, top_results=top_results,
+                                                   search_mode=f"hybrid:{vector_mode.value}", search=search)
 
     @staticmethod
-    def do_semantic_reranker_search(openai_client: AzureOpenAI, search_client: SearchClient, *,
-                                    semantic_configuration_name: str, query: str,
-                                    top_results: int = 5) -> SearchIndexResults:
+    def do_semantic_reranker_search(openai_client: AzureOpenAI | AzureOpenAIClientPool,
+                                    search_client: SearchClient, *, semantic_configuration_name: str, query: str,
+                                    top_results: int = 5,
+                                    vector_mode: AzureSearchVectorModes = AzureSearchVectorModes.FIRST_CHUNK,
+                                    cache: AzureSearchCache | None = None) -> SearchIndexResults:
         """
         Performs a semantic reranking search on the index.
-        :param openai_client: The Azure OpenAI client.
+        :param openai_client: The Azure OpenAI client or client pool.
         :param search_client: The search client.
         :param semantic_configuration_name: The semantic configuration name.
         :param query: The search query.
         :param top_results: The number of top results to return. The default value is 5.
+        :param vector_mode: How the query is vectorized. The default value is to embed only the first chunk.
+        :param cache: The search cache, which skips both the query embedding and the search on a hit. The default
+        value is none.
         :return: The search results.
         """
-        vector_query = AzureSearchIndex._get_vectorized_query(openai_client, query)
+        def search() -> SearchIndexResults:
+            vector_queries = AzureSearchIndex._get_vectorized_queries(openai_client, query, vector_mode)
 
-        # Do search.
-        results = search_client.search(query_answer=QueryAnswerType.EXTRACTIVE,
-                                       query_caption=QueryCaptionType.EXTRACTIVE, query_type=QueryType.SEMANTIC,
-                                       search_text=query, select=("Name", "Description", "Code"),
-                                       semantic_configuration_name=semantic_configuration_name, top=top_results,
-                                       vector_queries=[vector_query])
+            # Do search.
+            return AzureSearchIndex._search(search_client, vector_queries, vector_mode=vector_mode,
+                                            top_results=top_results, query_answer=QueryAnswerType.EXTRACTIVE,
+                                            query_caption=QueryCaptionType.EXTRACTIVE, query_type=QueryType.SEMANTIC,
+                                            search_text=query,
+                                            semantic_configuration_name=semantic_configuration_name)
 
-        # Return the search results.
-        return [(result["Name"], result["Description"], result["Code"]) for result in results]
+        return AzureSearchIndex._search_with_cache(cache, search_client, query=query, top_results=top_results,
+                                                   search_mode=f"semantic:{semantic_configuration_name}:"
+                                                               f"{vector_mode.value}", search=search)
@@ -0,0 +1,26 @@
+from enum import Enum
+from typing import final
+
+
+@final
+class AzureSearchVectorModes(str, Enum):
+    """
+    Enum constants for how long queries are vectorized for searching the index.
+    """
+    FIRST_CHUNK = "first"
+    MULTI_VECTOR = "multi"
+    RECIPROCAL_RANK_FUSION = "rrf"
+
+    def __repr__(self) -> str:
+        """
+        Returns a string representation of the object.
+        :return: A string representation of the object.
+        """
+        return f"{self.name}={self.value}"
+
+    def __str__(self) -> str:
+        """
+        Returns a string representation of the object.
+        :return: A string representation of the object.
+        """
+        return self.value
@@ -13,7 +13,9 @@ class EnvVariables:
     Constants for the environment variables.
     """
     AZURE_OPENAI_API_KEY: Final[str] = os.getenv("AZURE_OPENAI_API_KEY")
+    AZURE_OPENAI_BATCH_ENDPOINT: Final[str] = os.getenv("AZURE_OPENAI_BATCH_ENDPOINT")
     AZURE_OPENAI_ENDPOINT: Final[str] = os.getenv("AZURE_OPENAI_ENDPOINT")
+    AZURE_OPENAI_POOL_CONFIG: Final[str] = os.getenv("AZURE_OPENAI_POOL_CONFIG")
     AZURE_SEARCH_KEY: Final[str] = os.getenv("AZURE_SEARCH_KEY")
     AZURE_SEARCH_SERVICE_ENDPOINT: Final[str] = os.getenv("AZURE_SEARCH_SERVICE_ENDPOINT")
     JIRA_API_ENDPOINT: Final[str] = os.getenv("JIRA_API_ENDPOINT")
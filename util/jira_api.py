@@ -0,0 +1,71 @@
+from typing import Any, Final, final
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+
+from util.env_variables import EnvVariables
+
+
+@final
+class JiraApi:
+    """
+    Utility class for the JIRA REST API. All calls share one pooled session.
+    """
+    _MAX_RESULTS: Final[int] = 100
+    _POOL_SIZE: Final[int] = 16
+    _SEARCH_ENDPOINT: Final[str] = str(EnvVariables.JIRA_API_ENDPOINT).removesuffix("/issue") + "/search/jql"
+    _SESSION: Final[requests.Session] = requests.Session()
+
+    # Authenticate once and keep enough pooled connections for concurrent calls.
+    _SESSION.auth = HTTPBasicAuth(EnvVariables.JIRA_API_USERNAME, EnvVariables.JIRA_API_TOKEN)
+    _SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=_POOL_SIZE))
+
+    @staticmethod
+    def get_issue(issue_key: str, *, fields: list[str], expand: list[str] | None = None) -> dict[str, Any]:
+        """
+        Returns an issue.
+        :param issue_key: The issue key (e.g. QUO-5620).
+        :param fields: The fields to return.
+        :param expand: The entities to expand. The default value is none.
+        :return: The issue.
+        :raises RuntimeError: If an error occurs while retrieving the issue.
+        """
+        params = {"fields": ",".join(fields)}
+
+        if expand:
+            params["expand"] = ",".join(expand)
+
+        response = JiraApi._SESSION.get(f"{EnvVariables.JIRA_API_ENDPOINT}/{issue_key}", params=params)
+
+        # If the request was successful, the status code will be 200.
+        if response.status_code != 200:
+            raise RuntimeError(f"Error retrieving JIRA ticket {issue_key}. API response: {response.status_code}")
+
+        return response.json()
+
+    @staticmethod
+    def search(jql: str, *, fields: list[str]) -> list[dict[str, Any]]:
+        """
+        Returns every issue matching the JQL, following the result pages.
+        :param jql: The JQL query.
+        :param fields: The fields to return.
+        :return: The issues.
+        :raises RuntimeError: If an error occurs while searching.
+        """
+        issues = []
+        params = {"jql": jql, "fields": ",".join(fields), "maxResults": JiraApi._MAX_RESULTS}
+
+        while True:
+            response = JiraApi._SESSION.get(JiraApi._SEARCH_ENDPOINT, params=params)
+
+            if response.status_code != 200:
+                raise RuntimeError(f"Error searching JIRA tickets. API response: {response.status_code}")
+
+            data = response.json()
+            issues.extend(data.get("issues", []))
+
+            if data.get("isLast", True) or not data.get("nextPageToken"):
+                return issues
+
+            params["nextPageToken"] = data["nextPageToken"]
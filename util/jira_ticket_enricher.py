@@ -0,0 +1,123 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Any, Final, final
+
+from util.jira_api import JiraApi
+from util.token_chunker import TokenChunker
+
+
+@final
+class JiraTicketEnricher:
+    """
+    Utility class for adding the subtasks, linked issues and comments of a JIRA ticket to its ticket information.
+    """
+    FIELDS: Final[tuple[str, ...]] = ("comment", "issuelinks", "subtasks", "summary")
+    _MAX_ISSUES: Final[int] = 50  # The maximum number of referenced issues to retrieve.
+    _MAX_REFERENCES: Final[int] = 10  # The maximum number of references to follow from each issue.
+    _MAX_WORKERS: Final[int] = 8
+
+    @staticmethod
+    def _get_comments(issue: dict[str, Any]) -> list[str]:
+        """
+        Returns the comments of an issue as sections.
+        :param issue: The issue.
+        :return: The comment sections.
+        """
+        comments = (issue["fields"].get("comment") or {}).get("comments", [])
+
+        return [f"Comment on {issue['key']} by {(comment.get('author') or {}).get('displayName', 'unknown')}:\n"
+                f"{comment['body']}" for comment in comments if isinstance(comment.get("body"), str)]
+
+    @staticmethod
+    def _get_references(issue: dict[str, Any]) -> list[tuple[str, str]]:
+        """
+        Returns the subtasks and linked issues of an issue, up to the maximum number of references.
+        :param issue: The issue.
+        :return: The issue keys with how they relate to the issue (e.g. "subtask of QUO-5620").
+        """
+        subtasks = issue["fields"].get("subtasks") or []
+        references = [(subtask["key"], f"subtask of {issue['key']}") for subtask in subtasks]
+
+        for link in issue["fields"].get("issuelinks") or []:
+            if "outwardIssue" in link:
+                references.append((link["outwardIssue"]["key"], f"{issue['key']} {link['type']['outward']}"))
+            elif "inwardIssue" in link:
+                references.append((link["inwardIssue"]["key"], f"{issue['key']} {link['type']['inward']}"))
+
+        return references[:JiraTicketEnricher._MAX_REFERENCES]
+
+    @staticmethod
+    def enrich(issue: dict[str, Any], *, field: str, depth: int, max_tokens: int) -> str:
+        """
+        Returns the ticket information of an issue followed by its comments and the information and comments of its
+        subtasks and linked issues, level by level. The referenced issues of each level are retrieved concurrently, so
+        each level costs one round trip. Sections that would exceed the token budget are left out.
+        :param issue: The issue, retrieved with the field and the enrichment fields.
+        :param field: The ticket information field.
+        :param depth: The number of levels of referenced issues to retrieve.
+        :param max_tokens: The token budget for the ticket information.
+        :return: The ticket information.
+        """
+        from util import Logger  # Avoid circular import.
+
+        retrieved = 0
+        sections = JiraTicketEnricher._get_comments(issue)
+        visited = {issue["key"]}
+        level = [(issue, "")]
+
+        for _ in range(depth):
+            references = []
+
+            for parent, _ in level:
+                for key, relation in JiraTicketEnricher._get_references(parent):
+                    if key not in visited and len(visited) <= JiraTicketEnricher._MAX_ISSUES:
+                        visited.add(key)
+                        references.append((key, relation))
+
+            if not references:
+                break
+
+            def get_issue(key: str) -> dict[str, Any] | None:
+                try:
+                    return JiraApi.get_issue(key, fields=[field, *JiraTicketEnricher.FIELDS])
+                except Exception as exception:
+                    Logger.warning("Skipping referenced issue %s: %s", key, exception)
+                    return None
+
+            with ThreadPoolExecutor(max_workers=JiraTicketEnricher._MAX_WORKERS) as executor:
+                futures = [executor.submit(copy_context().run, get_issue, key) for key, _ in references]
+                issues = [future.result() for future in futures]
+
+            level = [(referenced_issue, relation) for referenced_issue, (_, relation) in zip(issues, references)
+                     if referenced_issue]
+            retrieved += len(level)
+
+            # Add the issues of the level before their comments.
+            for referenced_issue, relation in level:
+                summary = referenced_issue["fields"].get("summary") or ""
+                info = referenced_issue["fields"].get(field)
+                sections.append(f"{referenced_issue['key']} ({relation}): {summary}" + (f"\n{info}" if info else ""))
+
+            for referenced_issue, _ in level:
+                sections.extend(JiraTicketEnricher._get_comments(referenced_issue))
+
+        # Add the sections in order while they fit in the token budget.
+        ticket_info = issue["fields"][field]
+        tokens = TokenChunker.count_tokens(ticket_info)
+        skipped = 0
+
+        for section in sections:
+            section = f"\n\n{section}"
+            section_tokens = TokenChunker.count_tokens(section)
+
+            if tokens + section_tokens > max_tokens:
+                skipped += 1
+                continue
+
+            ticket_info += section
+            tokens += section_tokens
+
+        Logger.info("Enriched %s with %s referenced issues in %s tokens; %s of %s sections did not fit.", issue["key"],
+                    retrieved, tokens, skipped, len(sections))
+
+        return ticket_info
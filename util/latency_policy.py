@@ -0,0 +1,186 @@
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from typing import Callable, Final, TypeVar, final
+
+from openai import APIConnectionError, APIStatusError
+
+T = TypeVar("T")
+
+
+@final
+class LatencyPolicy:
+    """
+    Policy for hedging and falling back across model deployments.
+    """
+    _MAX_IN_FLIGHT: Final[int] = 2
+    _MAX_SAMPLES: Final[int] = 200
+    _MIN_SAMPLES: Final[int] = 20
+
+    def __init__(self, *, models: list[str], hedge_delay: float | None = None, hedge_percentile: float | None = None,
+                 timeout: float | None = None) -> None:
+        """
+        Initializes the policy.
+        :param models: The models to use, in order of preference. The first model is the primary model.
+        :param hedge_delay: The number of seconds to wait before issuing a hedged request to the next model.
+        :param hedge_percentile: The latency percentile, learned from past calls, to wait before issuing a hedged
+        request. Only used if hedge_delay is not set.
+        :param timeout: The number of seconds to wait for each request before falling back to the next model.
+        :raises ValueError: If no models are specified or the hedge percentile is not between 0 and 100.
+        """
+        if not models:
+            raise ValueError("At least one model must be specified.")
+
+        if hedge_percentile is not None and not 0 < hedge_percentile < 100:
+            raise ValueError("The hedge percentile must be between 0 and 100.")
+
+        self.hedge_delay = hedge_delay
+        self.hedge_percentile = hedge_percentile
+        self.models = models
+        self.timeout = timeout
+        self._latencies: deque[float] = deque(maxlen=LatencyPolicy._MAX_SAMPLES)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_retryable(exception: BaseException) -> bool:
+        """
+        Returns whether a failed request should fall back to the next model.
+        :param exception: The exception raised by the request.
+        :return: True if the request timed out, could not connect, was throttled or returned a 5xx status code.
+        """
+        # Each model is a separate deployment with its own quota, so a throttled request can go to the next model.
+        if isinstance(exception, APIStatusError):
+            return exception.status_code == 429 or exception.status_code >= 500
+
+        return isinstance(exception, (APIConnectionError, TimeoutError))
+
+    def add_latencies(self, latencies: list[float]) -> None:
+        """
+        Adds the latencies of earlier requests, e.g. saved by an earlier run, to learn the hedge delay from.
+        :param latencies: The latencies in seconds, oldest first.
+        :return: None
+        """
+        with self._lock:
+            self._latencies.extend(latencies)
+
+    def get_hedge_delay(self) -> float | None:
+        """
+        Returns the number of seconds to wait before issuing a hedged request.
+        :return: The configured delay, the learned percentile latency, or None if hedging is disabled or there are not
+        enough samples to learn from.
+        """
+        if len(self.models) < 2:
+            return None
+
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+
+        if self.hedge_percentile is None:
+            return None
+
+        with self._lock:
+            if len(self._latencies) < LatencyPolicy._MIN_SAMPLES:
+                return None
+
+            latencies = sorted(self._latencies)
+
+        # Nearest-rank percentile.
+        rank = math.ceil(self.hedge_percentile / 100 * len(latencies))
+
+        return latencies[max(rank - 1, 0)]
+
+    def get_latencies(self) -> list[float]:
+        """
+        Returns the latencies of the most recent successful requests.
+        :return: The latencies in seconds, oldest first.
+        """
+        with self._lock:
+            return list(self._latencies)
+
+    def record_latency(self, seconds: float) -> None:
+        """
+        Records the latency of a successful request.
+        :param seconds: The latency in seconds.
+        :return: None
+        """
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def run(self, request: Callable[[str, float | None], T]) -> T:
+        """
+        Runs the request against the primary model, hedging and falling back to the next models as configured. The
+        first successful response is returned and any other outstanding requests are cancelled.
+        :param request: A callable taking the model and the timeout that makes the request.
+        :return: The first successful response.
+        :raises Exception: The error from a request that is not retryable once no other request is in flight, or the
+        last error if every model failed.
+        """
+        from util import Logger  # Avoid circular import.
+
+        executor = ThreadPoolExecutor(max_workers=LatencyPolicy._MAX_IN_FLIGHT, thread_name_prefix="latency-policy")
+        hedge_delay = self.get_hedge_delay()
+        fatal_exception = None
+        last_exception = None
+        pending: dict[Future, tuple[str, float]] = {}
+        remaining = deque(self.models)
+
+        def submit() -> None:
+            model = remaining.popleft()
+            # Run in a copy of the caller's context so log records keep the ticket and stage.
+            future = executor.submit(copy_context().run, request, model, self.timeout)
+            pending[future] = (model, time.perf_counter())
+
+        try:
+            submit()
+
+            while pending:
+                # Only hedge while a single request is in flight and there is another model to hedge to.
+                # Once a request failed with an error that is not retryable, only wait for the requests in flight.
+                can_hedge = hedge_delay is not None and remaining and len(pending) < LatencyPolicy._MAX_IN_FLIGHT and \
+                    fatal_exception is None
+                done, _ = wait(pending, timeout=hedge_delay if can_hedge else None, return_when=FIRST_COMPLETED)
+
+                if not done:
+                    Logger.info("No response after %.2fs; hedging request to model '%s'...", hedge_delay, remaining[0])
+                    submit()
+                    continue
+
+                for future in done:
+                    model, start = pending.pop(future)
+
+                    try:
+                        result = future.result()
+                    except Exception as exception:
+                        # Keep waiting for the other request in flight rather than raising at once.
+                        if not LatencyPolicy.is_retryable(exception):
+                            Logger.warning("Request to model '%s' failed (%s).", model, exception)
+                            fatal_exception = exception
+                            continue
+
+                        last_exception = exception
+
+                        if remaining and fatal_exception is None:
+                            Logger.warning("Request to model '%s' failed (%s); falling back to model '%s'...", model,
+                                           exception, remaining[0])
+                            submit()
+
+                        continue
+
+                    self.record_latency(time.perf_counter() - start)
+
+                    if pending:
+                        Logger.debug("Response received from model '%s'; cancelling %s outstanding request(s).", model,
+                                     len(pending))
+
+                    return result
+
+            raise fatal_exception or last_exception
+        finally:
+            # Cancel requests that have not started; requests in flight are abandoned and bounded by the timeout.
+            for future in pending:
+                future.cancel()
+
+            executor.shutdown(wait=False, cancel_futures=True)
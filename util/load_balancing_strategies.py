@@ -0,0 +1,25 @@
+from enum import Enum
+from typing import final
+
+
+@final
+class LoadBalancingStrategies(str, Enum):
+    """
+    Enum constants for the client pool load balancing strategies.
+    """
+    LEAST_OUTSTANDING = "least-outstanding"
+    ROUND_ROBIN = "round-robin"
+
+    def __repr__(self) -> str:
+        """
+        Returns a string representation of the object.
+        :return: A string representation of the object.
+        """
+        return f"{self.name}={self.value}"
+
+    def __str__(self) -> str:
+        """
+        Returns a string representation of the object.
+        :return: A string representation of the object.
+        """
+        return self.value
@@ -1,6 +1,12 @@
+import atexit
+import json
 import logging
+import queue
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime
-from typing import final
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Callable, Final, Iterator, final
 
 from definitions import OS_IS_WINDOWS
 from util import ConsoleColors as Colors
@@ -11,23 +17,113 @@ if OS_IS_WINDOWS:
 
     just_fix_windows_console()
 
+# Context fields (e.g. ticket and stage) added to each log record.
+_CONTEXT: Final[ContextVar[dict[str, str]]] = ContextVar("log_context", default={})
+
+
+@final
+class _ColorFormatter(logging.Formatter):
+    """
+    Formatter for colored console output.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        """
+        Formats the record.
+        :param record: The log record.
+        :return: The formatted record.
+        """
+        current_time = Logger._color_time(record.created)
+        context = getattr(record, "context", None)
+        double_right_arrow = f"{Colors.CYAN}»{Colors.RESET}"
+        level = Logger._color_log_level(record.levelno)
+        message = Logger._color_message(record.levelno, record.getMessage())
+        right_arrow = f"{Colors.BRIGHT_GREEN}➡{Colors.RESET}"
+
+        if context:
+            level = f"{level} {Colors.DIM}{'/'.join(context.values())}{Colors.RESET}"
+
+        return f"{right_arrow} {current_time} {level} {double_right_arrow} {message}"
+
+
+@final
+class _ContextFilter(logging.Filter):
+    """
+    Filter that adds the current context fields to the log record.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """
+        Adds the context fields to the record.
+        :param record: The log record.
+        :return: True, so the record is always logged.
+        """
+        record.context = _CONTEXT.get()
+
+        return True
+
+
+@final
+class _JsonFormatter(logging.Formatter):
+    """
+    Formatter for JSON lines output.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        """
+        Formats the record.
+        :param record: The log record.
+        :return: The formatted record.
+        """
+        entry = {"time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+                 "level": record.levelname, "logger": record.name, **getattr(record, "context", {}),
+                 "message": record.getMessage()}
+
+        return json.dumps(entry)
+
+
+@final
+class _LazyArgument:
+    """
+    A log argument that is only computed if the record is emitted.
+    """
+
+    def __init__(self, function: Callable[..., Any], args: tuple[Any, ...]) -> None:
+        """
+        Initializes the argument.
+        :param function: The function that computes the argument.
+        :param args: The arguments for the function.
+        """
+        self._args = args
+        self._function = function
+
+    def __str__(self) -> str:
+        """
+        Computes the argument.
+        :return: A string representation of the argument.
+        """
+        return str(self._function(*self._args))
+
 
 @final
 class Logger:
     """
     Utility class for logging.
     """
+    _LOGGER: Final[logging.Logger] = logging.getLogger("pygen")
+    _listener: QueueListener | None = None
 
     @staticmethod
-    def _color_current_time() -> str:
+    def _color_time(created: float) -> str:
         """
-        Adds color to the current time.
-        :return: The current time.
+        Adds color to the time.
+        :param created: The time as seconds since the epoch.
+        :return: The time.
         """
         date_format = "%Y-%m-%d %H:%M:%S,%f"
-        now = datetime.now().strftime(date_format)[:-3]  # Truncate the microseconds to milliseconds.
+        time = datetime.fromtimestamp(created).strftime(date_format)[:-3]  # Truncate the microseconds to milliseconds.
 
-        return f"{Colors.DIM}{now}{Colors.RESET}"
+        return f"{Colors.DIM}{time}{Colors.RESET}"
 
     @staticmethod
     def _color_log_level(log_level: int) -> str:
@@ -71,53 +167,109 @@ class Logger:
         return message
 
     @staticmethod
-    def _log_message(*, log_level: int, message: str) -> None:
+    @contextmanager
+    def context(**fields: str) -> Iterator[None]:
         """
-        Logs the message.
-        :param log_level: The log level.
-        :param message: The message.
-        :return: None
+        Adds context fields (e.g. ticket and stage) to the records logged within the context.
+        :param fields: The context fields.
+        :return: An iterator for the context manager.
         """
-        current_time = Logger._color_current_time()
-        double_right_arrow = f"{Colors.CYAN}»{Colors.RESET}"
-        level = Logger._color_log_level(log_level)
-        message = Logger._color_message(log_level, message)
-        right_arrow = f"{Colors.BRIGHT_GREEN}➡{Colors.RESET}"
+        token = _CONTEXT.set({**_CONTEXT.get(), **fields})
 
-        logging.log(level=log_level, msg=f"{right_arrow} {current_time} {level} {double_right_arrow} {message}")
+        try:
+            yield
+        finally:
+            _CONTEXT.reset(token)
 
     @staticmethod
-    def debug(message: str) -> None:
+    def debug(message: str, *args: Any) -> None:
         """
         Logs the message.
-        :param message: The message.
+        :param message: The message, with %-style placeholders for the arguments.
+        :param args: The arguments, only formatted into the message if the record is emitted.
         :return: None
         """
-        Logger._log_message(log_level=logging.DEBUG, message=message)
+        Logger._LOGGER.debug(message, *args)
 
     @staticmethod
-    def error(message: str) -> None:
+    def error(message: str, *args: Any) -> None:
         """
         Logs the message.
-        :param message: The message.
+        :param message: The message, with %-style placeholders for the arguments.
+        :param args: The arguments, only formatted into the message if the record is emitted.
         :return: None
         """
-        Logger._log_message(log_level=logging.ERROR, message=message)
+        Logger._LOGGER.error(message, *args)
 
     @staticmethod
-    def info(message: str) -> None:
+    def info(message: str, *args: Any) -> None:
         """
         Logs the message.
-        :param message: The message.
+        :param message: The message, with %-style placeholders for the arguments.
+        :param args: The arguments, only formatted into the message if the record is emitted.
+        :return: None
+        """
+        Logger._LOGGER.info(message, *args)
+
+    @staticmethod
+    def initialize(log_level: int, *, json_format: bool = False) -> None:
+        """
+        Initializes logging. Records are queued and written by a background thread so I/O stays off the callers'
+        threads.
+        :param log_level: The log level.
+        :param json_format: Whether to write JSON lines instead of colored text. The default value is False.
+        :return: None
+        """
+        if Logger._listener:
+            return
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = QueueHandler(log_queue)
+        stream_handler = logging.StreamHandler()
+
+        # The context is captured on the caller's thread before the record is queued.
+        queue_handler.addFilter(_ContextFilter())
+        stream_handler.setFormatter(_JsonFormatter() if json_format else _ColorFormatter())
+
+        root_logger = logging.getLogger()
+        root_logger.addHandler(queue_handler)
+        root_logger.setLevel(log_level)
+
+        # Set log levels for imported modules to ERROR.
+        for module in ["azure", "httpcore", "httpx", "openai", "urllib3"]:
+            logging.getLogger(module).setLevel(logging.ERROR)
+
+        Logger._listener = QueueListener(log_queue, stream_handler)
+        Logger._listener.start()
+        atexit.register(Logger.shutdown)
+
+    @staticmethod
+    def lazy(function: Callable[..., Any], *args: Any) -> _LazyArgument:
+        """
+        Returns a log argument that is only computed if the record is emitted. Used for expensive payloads, e.g.
+        Logger.debug("Chat history:\n%s", Logger.lazy(json.dumps, chat_history)).
+        :param function: The function that computes the argument.
+        :param args: The arguments for the function.
+        :return: The lazy argument.
+        """
+        return _LazyArgument(function, args)
+
+    @staticmethod
+    def shutdown() -> None:
+        """
+        Writes the queued records and stops the background writer.
         :return: None
         """
-        Logger._log_message(log_level=logging.INFO, message=message)
+        if Logger._listener:
+            Logger._listener.stop()
+            Logger._listener = None
 
     @staticmethod
-    def warning(message: str) -> None:
+    def warning(message: str, *args: Any) -> None:
         """
         Logs the message.
-        :param message: The message.
+        :param message: The message, with %-style placeholders for the arguments.
+        :param args: The arguments, only formatted into the message if the record is emitted.
         :return: None
         """
-        Logger._log_message(log_level=logging.WARNING, message=message)
+        Logger._LOGGER.warning(message, *args)
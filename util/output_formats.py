@@ -0,0 +1,29 @@
+from enum import Enum
+from typing import final
+
+
+@final
+class OutputFormats(str, Enum):
+    """
+    Enum constants for the supported output formats.
+    """
+    FILES = "files"
+    JSONL = "jsonl"
+    JSONL_GZ = "jsonl.gz"
+    JSONL_ZST = "jsonl.zst"
+    TAR = "tar"
+    ZIP = "zip"
+
+    def __repr__(self) -> str:
+        """
+        Returns a string representation of the object.
+        :return: A string representation of the object.
+        """
+        return f"{self.name}={self.value}"
+
+    def __str__(self) -> str:
+        """
+        Returns a string representation of the object.
+        :return: A string representation of the object.
+        """
+        return self.value
@@ -0,0 +1,291 @@
+import gzip
+import io
+import json
+import os
+import tarfile
+import time
+import zipfile
+from abc import ABC, abstractmethod
+from typing import Any, BinaryIO, Callable, Final, final
+
+from util.output_formats import OutputFormats
+
+
+class OutputSink(ABC):
+    """
+    Base class for the sinks that the generated output is written to.
+    """
+    _BUFFER_SIZE: Final[int] = 1024 * 1024
+
+    def __init__(self) -> None:
+        """
+        Initializes the sink.
+        """
+        self._on_saved: list[Callable[[], None]] = []
+
+    @staticmethod
+    def create(output_format: OutputFormats, folder: str) -> "OutputSink":
+        """
+        Creates an output sink for the format.
+        :param output_format: The output format.
+        :param folder: The output folder.
+        :return: The output sink.
+        """
+        os.makedirs(folder, exist_ok=True)
+
+        match output_format:
+            case OutputFormats.FILES:
+                return _FilesOutputSink(folder)
+            case OutputFormats.TAR | OutputFormats.ZIP:
+                return _ArchiveOutputSink(folder, output_format)
+            case _:
+                return _JsonlOutputSink(folder, output_format)
+
+    @abstractmethod
+    def _close(self) -> None:
+        """
+        Flushes the buffered writes and syncs them to disk.
+        :return: None
+        """
+
+    @abstractmethod
+    def _write(self, *, files: dict[str, str], record: dict[str, Any]) -> None:
+        """
+        Writes the output for a ticket.
+        :param files: The output files by file name, used by the file and archive sinks.
+        :param record: The output record, used by the JSONL sink.
+        :return: None
+        """
+
+    def close(self) -> None:
+        """
+        Flushes the buffered writes and syncs them to disk, then calls the callbacks of the written outputs.
+        :return: None
+        """
+        self._close()
+
+        for on_saved in self._on_saved:
+            on_saved()
+
+        self._on_saved.clear()
+
+    @abstractmethod
+    def get_location(self, file_name: str) -> str:
+        """
+        Returns where an output file is written to, for logging.
+        :param file_name: The output file name.
+        :return: The location.
+        """
+
+    def write(self, *, files: dict[str, str], record: dict[str, Any],
+              on_saved: Callable[[], None] | None = None) -> None:
+        """
+        Writes the output for a ticket. The output may be buffered until the sink is closed.
+        :param files: The output files by file name, used by the file and archive sinks.
+        :param record: The output record, used by the JSONL sink.
+        :param on_saved: A function to call once the output is synced to disk. The default value is none.
+        :return: None
+        """
+        self._write(files=files, record=record)
+
+        if on_saved:
+            self._on_saved.append(on_saved)
+
+
+@final
+class _ArchiveOutputSink(OutputSink):
+    """
+    Output sink that bundles the output files into a single zip or tar archive.
+    """
+
+    def __init__(self, folder: str, output_format: OutputFormats) -> None:
+        """
+        Opens a new archive, written to a temporary file until the sink is closed.
+        :param folder: The output folder.
+        :param output_format: The archive format.
+        """
+        super().__init__()
+        base_name = os.path.join(folder, f"pygen-output-{time.strftime('%Y%m%d-%H%M%S')}")
+        self._file_name = f"{base_name}.{output_format}"
+        index = 1
+
+        # Do not overwrite an archive created in the same second, e.g. by a quick watch mode batch.
+        while os.path.exists(self._file_name):
+            index += 1
+            self._file_name = f"{base_name}-{index}.{output_format}"
+        self._file = open(f"{self._file_name}.tmp", mode="wb", buffering=OutputSink._BUFFER_SIZE)
+
+        if output_format == OutputFormats.ZIP:
+            self._tar = None
+            self._zip = zipfile.ZipFile(self._file, mode="w", compression=zipfile.ZIP_DEFLATED)
+        else:
+            self._tar = tarfile.open(fileobj=self._file, mode="w")
+            self._zip = None
+
+    def _close(self) -> None:
+        """
+        Flushes the buffered writes and syncs them to disk.
+        :return: None
+        """
+        if self._zip:
+            self._zip.close()
+        else:
+            self._tar.close()
+
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(f"{self._file_name}.tmp", self._file_name)
+
+    def _write(self, *, files: dict[str, str], record: dict[str, Any]) -> None:
+        """
+        Writes the output for a ticket.
+        :param files: The output files by file name.
+        :param record: The output record.
+        :return: None
+        """
+        for file_name, content in files.items():
+            data = content.encode("utf-8")
+
+            if self._zip:
+                self._zip.writestr(file_name, data)
+            else:
+                info = tarfile.TarInfo(file_name)
+                info.mtime = int(time.time())
+                info.size = len(data)
+                self._tar.addfile(info, io.BytesIO(data))
+
+    def get_location(self, file_name: str) -> str:
+        """
+        Returns where an output file is written to, for logging.
+        :param file_name: The output file name.
+        :return: The location.
+        """
+        return f"{self._file_name}:{file_name}"
+
+
+@final
+class _FilesOutputSink(OutputSink):
+    """
+    Output sink that writes each output file atomically to the output folder.
+    """
+
+    def __init__(self, folder: str) -> None:
+        """
+        Initializes the sink.
+        :param folder: The output folder.
+        """
+        super().__init__()
+        self._folder = folder
+        self._paths: set[str] = set()
+
+    def _close(self) -> None:
+        """
+        Flushes the buffered writes and syncs them to disk.
+        :return: None
+        """
+        # Sync each written file once at the end instead of on every write, then the folder so the renames persist.
+        for path in self._paths:
+            with open(path, mode="rb") as file:
+                os.fsync(file.fileno())
+
+        if self._paths and hasattr(os, "O_DIRECTORY"):
+            folder = os.open(self._folder, os.O_RDONLY | os.O_DIRECTORY)
+
+            try:
+                os.fsync(folder)
+            finally:
+                os.close(folder)
+
+        self._paths.clear()
+
+    def _write(self, *, files: dict[str, str], record: dict[str, Any]) -> None:
+        """
+        Writes the output for a ticket.
+        :param files: The output files by file name.
+        :param record: The output record.
+        :return: None
+        """
+        for file_name, content in files.items():
+            path = self.get_location(file_name)
+
+            # Write to a temporary file and move it into place so a partially written file is never seen.
+            with open(f"{path}.tmp", encoding="utf-8", mode="w", newline="") as file:
+                file.write(content)
+
+            os.replace(f"{path}.tmp", path)
+            self._paths.add(path)
+
+    def get_location(self, file_name: str) -> str:
+        """
+        Returns where an output file is written to, for logging.
+        :param file_name: The output file name.
+        :return: The location.
+        """
+        return os.path.join(self._folder, file_name)
+
+
+@final
+class _JsonlOutputSink(OutputSink):
+    """
+    Output sink that appends a record per ticket to a single, optionally compressed, JSONL file.
+    """
+
+    def __init__(self, folder: str, output_format: OutputFormats) -> None:
+        """
+        Opens the JSONL file for appending.
+        :param folder: The output folder.
+        :param output_format: The JSONL format.
+        :raises RuntimeError: If the zstandard package is required but not installed.
+        """
+        super().__init__()
+        zstandard = None
+
+        # Check for the package before opening the file, so a missing package does not leave an empty file behind.
+        if output_format == OutputFormats.JSONL_ZST:
+            try:
+                import zstandard
+            except ImportError:
+                raise RuntimeError("The zstandard package is required for the jsonl.zst output format.")
+
+        self._compressor = None
+        self._file_name = os.path.join(folder, f"pygen-output.{output_format}")
+        self._file = open(self._file_name, mode="ab", buffering=OutputSink._BUFFER_SIZE)
+
+        # Appending starts a new gzip member or zstd frame, which readers decompress as one stream.
+        match output_format:
+            case OutputFormats.JSONL_GZ:
+                self._compressor = gzip.GzipFile(fileobj=self._file, mode="ab")
+            case OutputFormats.JSONL_ZST:
+                self._compressor = zstandard.ZstdCompressor().stream_writer(self._file, closefd=False)
+
+        self._writer: BinaryIO = self._compressor if self._compressor else self._file
+
+    def _close(self) -> None:
+        """
+        Flushes the buffered writes and syncs them to disk.
+        :return: None
+        """
+        if self._compressor:
+            self._compressor.close()
+
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+    def _write(self, *, files: dict[str, str], record: dict[str, Any]) -> None:
+        """
+        Writes the output for a ticket.
+        :param files: The output files by file name.
+        :param record: The output record.
+        :return: None
+        """
+        self._writer.write(f"{json.dumps(record)}\n".encode("utf-8"))
+
+    def get_location(self, file_name: str) -> str:
+        """
+        Returns where an output file is written to, for logging.
+        :param file_name: The output file name.
+        :return: The location.
+        """
+        return self._file_name
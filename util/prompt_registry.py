@@ -0,0 +1,59 @@
+import os
+import threading
+from typing import final
+
+from util.system_messages import SystemMessages
+from util.token_chunker import TokenChunker
+
+
+@final
+class PromptRegistry:
+    """
+    Registry of the system messages. Each system message is read once, with its token count, and read again only when
+    its file is modified.
+    """
+    _lock = threading.Lock()
+    _prompts: dict[str, tuple[int, str, int]] = {}  # The modified time, content and token count, by file path.
+
+    @staticmethod
+    def _load(system_message: SystemMessages) -> tuple[int, str, int]:
+        """
+        Returns a system message, reading it again if its file was modified since it was read.
+        :param system_message: The system message.
+        :return: The modified time, content and token count of the system message.
+        """
+        from util import Logger  # Avoid circular import.
+
+        file_name = str(system_message)
+        modified = os.stat(file_name).st_mtime_ns
+        prompt = PromptRegistry._prompts.get(file_name)
+
+        if prompt is None or prompt[0] != modified:
+            with PromptRegistry._lock:
+                with open(file_name, encoding="utf-8", mode="r") as file:
+                    content = file.read().strip()
+
+                prompt = (modified, content, TokenChunker.count_tokens(content))
+                PromptRegistry._prompts[file_name] = prompt
+
+            Logger.debug("Loaded system message '%s' (%s tokens).", system_message.name, prompt[2])
+
+        return prompt
+
+    @staticmethod
+    def count_tokens(system_message: SystemMessages) -> int:
+        """
+        Returns the number of tokens in a system message.
+        :param system_message: The system message.
+        :return: The number of tokens.
+        """
+        return PromptRegistry._load(system_message)[2]
+
+    @staticmethod
+    def get(system_message: SystemMessages) -> str:
+        """
+        Returns the content of a system message.
+        :param system_message: The system message.
+        :return: The content.
+        """
+        return PromptRegistry._load(system_message)[1]
@@ -0,0 +1,42 @@
+import threading
+from typing import final
+
+
+@final
+class RunMetrics:
+    """
+    Thread-safe counters and gauges for the current run.
+    """
+    _lock = threading.Lock()
+    _metrics: dict[str, float] = {}
+
+    @staticmethod
+    def add(name: str, value: float = 1) -> None:
+        """
+        Adds to a counter.
+        :param name: The metric name.
+        :param value: The value to add. The default value is 1.
+        :return: None
+        """
+        with RunMetrics._lock:
+            RunMetrics._metrics[name] = RunMetrics._metrics.get(name, 0) + value
+
+    @staticmethod
+    def get() -> dict[str, float]:
+        """
+        Returns the metrics, sorted by name.
+        :return: The metric values by name.
+        """
+        with RunMetrics._lock:
+            return dict(sorted(RunMetrics._metrics.items()))
+
+    @staticmethod
+    def set(name: str, value: float) -> None:
+        """
+        Sets a gauge.
+        :param name: The metric name.
+        :param value: The value.
+        :return: None
+        """
+        with RunMetrics._lock:
+            RunMetrics._metrics[name] = value
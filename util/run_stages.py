@@ -0,0 +1,28 @@
+from enum import Enum
+from typing import final
+
+
+@final
+class RunStages(str, Enum):
+    """
+    Enum constants for the stages of a ticket run.
+    """
+    CODE = "code"
+    HELPER_METHODS = "helper_methods"
+    OUTPUT = "output"
+    TEST_CASES = "test_cases"
+    TICKET_INFO = "ticket_info"
+
+    def __repr__(self) -> str:
+        """
+        Returns a string representation of the object.
+        :return: A string representation of the object.
+        """
+        return f"{self.name}={self.value}"
+
+    def __str__(self) -> str:
+        """
+        Returns a string representation of the object.
+        :return: A string representation of the object.
+        """
+        return self.value
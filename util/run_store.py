@@ -0,0 +1,192 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from typing import Any, Final, final
+
+from util.run_stages import RunStages
+
+
+@final
+class RunStore:
+    """
+    SQLite store for checkpointing the stage outputs of each ticket so an interrupted run can be resumed.
+    """
+    _COMMIT_INTERVAL: Final[float] = 5.0
+    _COMMIT_SIZE: Final[int] = 100
+    _SCHEMA: Final[str] = """
+        CREATE TABLE IF NOT EXISTS runs (
+            id TEXT PRIMARY KEY,
+            created REAL NOT NULL,
+            options TEXT NOT NULL
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS stages (
+            run_id TEXT NOT NULL,
+            ticket_id TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            output BLOB NOT NULL,
+            seconds REAL NOT NULL,
+            completed REAL NOT NULL,
+            PRIMARY KEY (run_id, ticket_id, stage)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS latencies (
+            model TEXT PRIMARY KEY,
+            seconds TEXT NOT NULL
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS watermarks (
+            jql TEXT PRIMARY KEY,
+            updated TEXT NOT NULL
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, file_name: str) -> None:
+        """
+        Opens the run store, creating it if it does not exist.
+        :param file_name: The database file path.
+        """
+        self._connection = sqlite3.connect(file_name, check_same_thread=False, isolation_level=None)
+        self._last_commit = time.monotonic()
+        self._lock = threading.Lock()
+        self._pending = 0
+
+        # Write-ahead logging lets readers run alongside the writer and makes batched commits cheap.
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(RunStore._SCHEMA)
+
+    def _commit_if_due(self) -> None:
+        """
+        Commits the pending writes if enough writes are pending or enough time has passed since the last commit.
+        :return: None
+        """
+        if self._pending >= RunStore._COMMIT_SIZE or time.monotonic() - self._last_commit >= RunStore._COMMIT_INTERVAL:
+            self._commit()
+
+    def _commit(self) -> None:
+        """
+        Commits the pending writes.
+        :return: None
+        """
+        if self._connection.in_transaction:
+            self._connection.commit()
+
+        self._last_commit = time.monotonic()
+        self._pending = 0
+
+    def close(self) -> None:
+        """
+        Commits the pending writes and closes the run store.
+        :return: None
+        """
+        with self._lock:
+            self._commit()
+            self._connection.close()
+
+    def create_run(self, options: dict[str, Any]) -> str:
+        """
+        Creates a run.
+        :param options: The run options needed to resume the run.
+        :return: The run id.
+        """
+        run_id = uuid.uuid4().hex[:12]
+
+        with self._lock:
+            self._connection.execute("INSERT INTO runs (id, created, options) VALUES (?, ?, ?)",
+                                     (run_id, time.time(), json.dumps(options)))
+
+        return run_id
+
+    def get_latencies(self, model: str) -> list[float]:
+        """
+        Returns the latencies saved for a model.
+        :param model: The model.
+        :return: The latencies in seconds, oldest first, or an empty list if none were saved.
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT seconds FROM latencies WHERE model = ?", (model,)).fetchone()
+
+        return json.loads(row[0]) if row else []
+
+    def get_run_options(self, run_id: str) -> dict[str, Any] | None:
+        """
+        Returns the options of a run.
+        :param run_id: The run id.
+        :return: The run options, or None if the run does not exist.
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT options FROM runs WHERE id = ?", (run_id,)).fetchone()
+
+        return json.loads(row[0]) if row else None
+
+    def get_stage(self, run_id: str, ticket_id: str, stage: RunStages) -> str | None:
+        """
+        Returns the output of a completed stage.
+        :param run_id: The run id.
+        :param ticket_id: The JIRA ticket id.
+        :param stage: The stage.
+        :return: The stage output, or None if the stage has not completed.
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT output FROM stages WHERE run_id = ? AND ticket_id = ? AND stage = ?",
+                                           (run_id, ticket_id, stage.value)).fetchone()
+
+        return zlib.decompress(row[0]).decode("utf-8") if row else None
+
+    def get_watermark(self, jql: str) -> str | None:
+        """
+        Returns the watermark of a watched JQL filter.
+        :param jql: The JQL filter.
+        :return: The ISO 8601 time up to which updates were handled, or None if the filter was never watched.
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT updated FROM watermarks WHERE jql = ?", (jql,)).fetchone()
+
+        return row[0] if row else None
+
+    def save_latencies(self, model: str, latencies: list[float]) -> None:
+        """
+        Saves the latencies of a model, replacing the latencies saved before. The latencies are committed immediately,
+        along with any pending writes.
+        :param model: The model.
+        :param latencies: The latencies in seconds, oldest first.
+        :return: None
+        """
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO latencies (model, seconds) VALUES (?, ?)",
+                                     (model, json.dumps(latencies)))
+            self._commit()
+
+    def save_stage(self, run_id: str, ticket_id: str, stage: RunStages, output: str, seconds: float) -> None:
+        """
+        Saves the output of a completed stage. Writes are committed in batches.
+        :param run_id: The run id.
+        :param ticket_id: The JIRA ticket id.
+        :param stage: The stage.
+        :param output: The stage output.
+        :param seconds: The number of seconds the stage took.
+        :return: None
+        """
+        with self._lock:
+            if not self._connection.in_transaction:
+                self._connection.execute("BEGIN")
+
+            self._connection.execute("INSERT OR REPLACE INTO stages (run_id, ticket_id, stage, output, seconds, "
+                                     "completed) VALUES (?, ?, ?, ?, ?, ?)",
+                                     (run_id, ticket_id, stage.value, zlib.compress(output.encode("utf-8")), seconds,
+                                      time.time()))
+            self._pending += 1
+            self._commit_if_due()
+
+    def save_watermark(self, jql: str, updated: str) -> None:
+        """
+        Saves the watermark of a watched JQL filter. The watermark is committed immediately, along with any pending
+        writes.
+        :param jql: The JQL filter.
+        :param updated: The ISO 8601 time up to which updates were handled.
+        :return: None
+        """
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO watermarks (jql, updated) VALUES (?, ?)", (jql, updated))
+            self._commit()
@@ -0,0 +1,111 @@
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Final, final
+
+import numpy as np
+
+from definitions import Embeddings
+
+
+@final
+class SemanticCache:
+    """
+    SQLite store of ticket embeddings with the outputs generated for each ticket, for finding near-duplicate tickets.
+    The embeddings are kept in memory as a normalized float32 matrix, so a lookup is a single matrix-vector product.
+    """
+    _SCHEMA: Final[str] = """
+        CREATE TABLE IF NOT EXISTS tickets (
+            ticket_id TEXT PRIMARY KEY,
+            vector BLOB NOT NULL,
+            output BLOB NOT NULL,
+            created REAL NOT NULL
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, file_name: str) -> None:
+        """
+        Opens the semantic cache, creating it if it does not exist.
+        :param file_name: The database file path.
+        """
+        self._connection = sqlite3.connect(file_name, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(SemanticCache._SCHEMA)
+
+        # Load the embeddings of the cached tickets.
+        rows = self._connection.execute("SELECT ticket_id, vector FROM tickets").fetchall()
+        self._ticket_ids = [row[0] for row in rows]
+        self._vectors = np.array([np.frombuffer(row[1], dtype=np.float32) for row in rows], dtype=np.float32)
+
+    @staticmethod
+    def _normalize(vector: Embeddings) -> np.ndarray:
+        """
+        Returns a vector scaled to unit length, so the dot product of two vectors is their cosine similarity.
+        :param vector: The vector.
+        :return: The normalized vector.
+        """
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+
+        return array / norm if norm else array
+
+    def add(self, ticket_id: str, vector: Embeddings, output: dict[str, Any]) -> None:
+        """
+        Adds a ticket, replacing it if it was already added.
+        :param ticket_id: The JIRA ticket id.
+        :param vector: The embedding of the ticket information.
+        :param output: The outputs generated for the ticket (e.g. the ticket information, test cases and code).
+        :return: None
+        """
+        array = SemanticCache._normalize(vector)
+
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO tickets (ticket_id, vector, output, created) VALUES "
+                                     "(?, ?, ?, ?)",
+                                     (ticket_id, array.tobytes(), zlib.compress(json.dumps(output).encode("utf-8")),
+                                      time.time()))
+
+            if ticket_id in self._ticket_ids:
+                self._vectors[self._ticket_ids.index(ticket_id)] = array
+            else:
+                self._ticket_ids.append(ticket_id)
+                self._vectors = np.vstack([self._vectors, array]) if len(self._vectors) else array[np.newaxis]
+
+    def close(self) -> None:
+        """
+        Closes the semantic cache.
+        :return: None
+        """
+        with self._lock:
+            self._connection.close()
+
+    def find(self, vector: Embeddings, *, exclude: str | None = None) -> tuple[str, dict[str, Any], float] | None:
+        """
+        Returns the cached ticket most similar to a vector.
+        :param vector: The embedding of the ticket information.
+        :param exclude: A ticket id to leave out, e.g. the ticket itself. The default value is none.
+        :return: The ticket id, its outputs and its cosine similarity, or None if there are no other tickets.
+        """
+        with self._lock:
+            if not len(self._vectors):
+                return None
+
+            scores = self._vectors @ SemanticCache._normalize(vector)
+
+            if exclude in self._ticket_ids:
+                scores[self._ticket_ids.index(exclude)] = -np.inf
+
+            best = int(np.argmax(scores))
+
+            if scores[best] == -np.inf:
+                return None
+
+            ticket_id = self._ticket_ids[best]
+            row = self._connection.execute("SELECT output FROM tickets WHERE ticket_id = ?", (ticket_id,)).fetchone()
+
+        return ticket_id, json.loads(zlib.decompress(row[0])), float(scores[best])
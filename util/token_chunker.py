@@ -0,0 +1,171 @@
+from typing import Final, final
+
+import tiktoken
+from tiktoken import Encoding
+
+
+@final
+class TokenChunker:
+    """
+    Utility class for splitting text into chunks of tokens. Chunks are cut at paragraph or line boundaries where
+    possible and work on token arrays, so the text is encoded once and never decoded and re-encoded.
+    """
+    _LINE_BOUNDARY: Final[int] = 1
+    _MAX_THREADS: Final[int] = 8
+    _MIN_FILL: Final[float] = 0.5  # The minimum fraction of a chunk to keep before cutting at a boundary.
+    _NO_BOUNDARY: Final[int] = 0
+    _PARAGRAPH_BOUNDARY: Final[int] = 2
+    _TOKENIZER: Final[Encoding] = tiktoken.get_encoding("cl100k_base")
+    _boundaries: dict[int, int] = {}
+
+    @staticmethod
+    def _find_cut(tokens: list[int], start: int, end: int) -> int:
+        """
+        Returns where to cut a chunk, preferring the last paragraph boundary and then the last line boundary in the
+        second half of the chunk.
+        :param tokens: The tokens.
+        :param start: The start index of the chunk.
+        :param end: The maximum end index of the chunk.
+        :return: The end index of the chunk.
+        """
+        best_cut = end
+        best_boundary = TokenChunker._NO_BOUNDARY
+        min_end = start + max(int((end - start) * TokenChunker._MIN_FILL), 1)
+
+        for index in range(end - 1, min_end - 1, -1):
+            boundary = TokenChunker._get_boundary(tokens[index])
+
+            # A line boundary after another line boundary is a paragraph boundary.
+            if boundary == TokenChunker._LINE_BOUNDARY and TokenChunker._get_boundary(tokens[index - 1]):
+                boundary = TokenChunker._PARAGRAPH_BOUNDARY
+
+            if boundary > best_boundary:
+                best_boundary = boundary
+                best_cut = index + 1
+
+                if boundary == TokenChunker._PARAGRAPH_BOUNDARY:
+                    break
+
+        return best_cut
+
+    @staticmethod
+    def _get_boundary(token: int) -> int:
+        """
+        Returns the kind of boundary a token ends, caching the result for each token.
+        :param token: The token.
+        :return: The boundary.
+        """
+        boundary = TokenChunker._boundaries.get(token)
+
+        if boundary is None:
+            token_bytes = TokenChunker._TOKENIZER.decode_single_token_bytes(token).rstrip(b" \t\r")
+
+            if token_bytes.endswith(b"\n\n"):
+                boundary = TokenChunker._PARAGRAPH_BOUNDARY
+            elif token_bytes.endswith(b"\n"):
+                boundary = TokenChunker._LINE_BOUNDARY
+            else:
+                boundary = TokenChunker._NO_BOUNDARY
+
+            TokenChunker._boundaries[token] = boundary
+
+        return boundary
+
+    @staticmethod
+    def chunk_text(text: str, *, max_tokens: int, overlap: int = 0,
+                   max_chunks: int | None = None) -> list[list[int]]:
+        """
+        Encodes the text and splits it into chunks of tokens.
+        :param text: The text to split.
+        :param max_tokens: The maximum number of tokens in each chunk.
+        :param overlap: The number of tokens each chunk repeats from the end of the previous chunk, up to half of the
+        previous chunk. The default value is 0.
+        :param max_chunks: The maximum number of chunks to return, starting with the first. The default value is all.
+        :return: A list of token chunks.
+        :raises ValueError: If the input text is empty or not a string, or the overlap is not less than max_tokens.
+        """
+        if not isinstance(text, str) or not text:
+            raise ValueError("Input text must be a non-empty string.")
+
+        return TokenChunker.chunk_tokens(TokenChunker.encode(text), max_tokens=max_tokens, overlap=overlap,
+                                         max_chunks=max_chunks)
+
+    @staticmethod
+    def chunk_texts(texts: list[str], *, max_tokens: int, overlap: int = 0) -> list[list[list[int]]]:
+        """
+        Encodes the texts in parallel and splits each into chunks of tokens.
+        :param texts: The texts to split.
+        :param max_tokens: The maximum number of tokens in each chunk.
+        :param overlap: The number of tokens each chunk repeats from the end of the previous chunk, up to half of the
+        previous chunk. The default value is 0.
+        :return: A list of token chunks for each text.
+        :raises ValueError: If the overlap is not less than max_tokens.
+        """
+        encoded_texts = TokenChunker._TOKENIZER.encode_batch(texts, num_threads=TokenChunker._MAX_THREADS,
+                                                             disallowed_special=())
+
+        return [TokenChunker.chunk_tokens(tokens, max_tokens=max_tokens, overlap=overlap) for tokens in encoded_texts]
+
+    @staticmethod
+    def chunk_tokens(tokens: list[int], *, max_tokens: int, overlap: int = 0,
+                     max_chunks: int | None = None) -> list[list[int]]:
+        """
+        Splits the tokens into chunks.
+        :param tokens: The tokens to split.
+        :param max_tokens: The maximum number of tokens in each chunk.
+        :param overlap: The number of tokens each chunk repeats from the end of the previous chunk, up to half of the
+        previous chunk. The default value is 0.
+        :param max_chunks: The maximum number of chunks to return, starting with the first. The default value is all.
+        :return: A list of token chunks.
+        :raises ValueError: If the overlap is not less than max_tokens.
+        """
+        if not 0 <= overlap < max_tokens:
+            raise ValueError("The overlap must be at least 0 and less than the maximum number of tokens.")
+
+        chunks = []
+        start = 0
+
+        while start < len(tokens) and (max_chunks is None or len(chunks) < max_chunks):
+            end = min(start + max_tokens, len(tokens))
+
+            # Cut at a boundary unless this is the last chunk.
+            if end < len(tokens):
+                end = TokenChunker._find_cut(tokens, start, end)
+
+            chunks.append(tokens[start:end])
+
+            if end == len(tokens):
+                break
+
+            # Continue from the end of the chunk, repeating at most half of it so a chunk cut early at a boundary does
+            # not make the next chunk start just one token later.
+            start = end - min(overlap, (end - start) // 2)
+
+        return chunks
+
+    @staticmethod
+    def count_tokens(text: str) -> int:
+        """
+        Returns the number of tokens in the text.
+        :param text: The text.
+        :return: The number of tokens.
+        """
+        return len(TokenChunker.encode(text))
+
+    @staticmethod
+    def decode(tokens: list[int]) -> str:
+        """
+        Decodes the tokens into text.
+        :param tokens: The tokens.
+        :return: The text.
+        """
+        return TokenChunker._TOKENIZER.decode(tokens)
+
+    @staticmethod
+    def encode(text: str) -> list[int]:
+        """
+        Encodes the text into tokens. Special tokens are encoded as plain text.
+        :param text: The text.
+        :return: The tokens.
+        """
+        return TokenChunker._TOKENIZER.encode(text, disallowed_special=())